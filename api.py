@@ -1,26 +1,84 @@
 import os
-import requests
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from .views import ollama as ollama_provider
 from .models.Answer import *
 from .models.ollama import OllamaOptions
 from .views import pipelines as pipeline_provider
 from .views.pipelines import QueryPipeline
+from .controllers.image_fetcher import ImageFetcher, ImageFetchError
+from .views.stream import async_coalesce, async_to_sse, to_sse
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # learn which models every ollama host has, for route requests by model
+    await asyncio.to_thread(ollama_provider.controller.pool.refresh_models)
+    # tokenizer of rag context packing, loading can download files
+    await asyncio.to_thread(ollama_provider.context_packer.counter.load)
+    # background removal of collections of idle conversations
+    pipeline_provider.sessions.start()
+    yield
+    pipeline_provider.sessions.stop()
+    await image_fetcher.close()
+
 
 app = FastAPI(
     title="LLM Providers",
+    lifespan=lifespan,
 )
 
 DEFAULT_OLLAMA_MODEL:str = os.environ.get('DEFAULT_OLLAMA_MODEL', 'llama3.2:1b')
 DEFAULT_OLLAMA_EMB_MODEL: str = os.environ.get('DEFAULT_OLLAMA_EMB_MODEL', 'all-minilm:22m')
 DEFAULT_OLLAMA_IMG_MODEL: str = os.environ.get('DEFAULT_OLLAMA_IMG_MODEL', 'moondream:1.8b')
 
+# shared pooled downloader for image urls
+image_fetcher = ImageFetcher(
+    timeout = float(os.environ.get('IMAGE_FETCH_TIMEOUT', 10)),
+    max_bytes = int(os.environ.get('IMAGE_FETCH_MAX_BYTES', 20 * 1024 * 1024)),
+    max_connections = int(os.environ.get('IMAGE_FETCH_MAX_CONNECTIONS', 64)),
+)
+
+# every pipeline starts with validator on llama3
+PIPELINE_MODEL: str = 'llama3:latest'
+
+
+# raised by controllers imported by views, not by `.controllers` package of this module
+Overloaded = ollama_provider.controller.Overloaded
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, e: Overloaded) -> JSONResponse:
+    return JSONResponse(status_code=429, content={'detail': str(e)}, headers={'Retry-After': str(e.retry_after)})
+
+
+def admit(model: str) -> None:
+    # status of streaming response can not be changed after start, full queue is rejected before
+    try:
+        ollama_provider.controller.admission.check(model)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
+
+
+def stream_response(tokens, sse: bool = False, media_type: str = 'text') -> StreamingResponse:
+    # join tokens to bigger chunks, less writes and less proxy overhead
+    chunks = async_coalesce(tokens)
+    if sse:
+        return StreamingResponse(
+            async_to_sse(chunks), 
+            media_type='text/event-stream', 
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    return StreamingResponse(chunks, media_type=media_type)
+
+
+
 # --- TEXT ENDPOINTS --- 
 
 @app.post('/ollama/text/answer', tags=['text'])
-def text_answer(query: Answer, model: str| None = None, opt: OllamaOptions | None = None) -> Answer:
-    return ollama_provider.answer(
+async def text_answer(query: Answer, model: str| None = None, opt: OllamaOptions | None = None) -> Answer:
+    return await ollama_provider.async_answer(
         query=query,
         model = model or DEFAULT_OLLAMA_MODEL,
         options=opt
@@ -28,32 +86,34 @@ def text_answer(query: Answer, model: str| None = None, opt: OllamaOptions | Non
 
 
 @app.get('/ollama/text/answer', tags=['text'])
-def get_text_answer(query: str, model: str | None = None) -> Answer:
+async def get_text_answer(query: str, model: str | None = None) -> Answer:
     opt = OllamaOptions(numa=True, num_gpu=2, main_gpu=0)
-    return text_answer(Answer(query=query), model, opt) 
+    return await text_answer(Answer(query=query), model, opt) 
 
 
 
 @app.post('/ollama/text/answer/stream', tags=['text-stream'])
-def text_answer_stream(query: Answer, model: str| None = None, opt: OllamaOptions | None = None):
-    return StreamingResponse(ollama_provider.stream_answer(
+async def text_answer_stream(query: Answer, model: str| None = None, opt: OllamaOptions | None = None, sse: bool = False):
+    admit(model or DEFAULT_OLLAMA_MODEL)
+    return stream_response(ollama_provider.async_stream_answer(
         query=query,
         model = model or DEFAULT_OLLAMA_MODEL,
         options=opt
-    ), media_type='text')
+    ), sse)
 
 
 @app.get('/ollama/text/answer/stream', tags=['text-stream'])
-def get_text_answer_stream(query: str, model: str| None = None):
-    return StreamingResponse(ollama_provider.stream_answer(
+async def get_text_answer_stream(query: str, model: str| None = None, sse: bool = False):
+    admit(model or DEFAULT_OLLAMA_MODEL)
+    return stream_response(ollama_provider.async_stream_answer(
         query=Answer(query=query),
         model = model or DEFAULT_OLLAMA_MODEL,
-    ), media_type='text')
+    ), sse)
 
 
 @app.post('/ollama/text/raganswer', tags=['RAG'])
-def text_raganswer(query: RagAnswer, model: str | None = None, opt: OllamaOptions | None = None) -> RagAnswer:
-    return ollama_provider.rag_answer(
+async def text_raganswer(query: RagAnswer, model: str | None = None, opt: OllamaOptions | None = None) -> RagAnswer:
+    return await ollama_provider.async_rag_answer(
         query = query,
         model = model or DEFAULT_OLLAMA_MODEL,
         options=opt
@@ -61,37 +121,44 @@ def text_raganswer(query: RagAnswer, model: str | None = None, opt: OllamaOption
 
 
 @app.post('/ollama/text/raganswer/stream', tags=['RAG-stream'])
-def stream_text_raganswer(query: RagAnswer, model: str | None = None, opt: OllamaOptions | None = None):
-    return StreamingResponse(ollama_provider.stream_rag_answer(
+async def stream_text_raganswer(query: RagAnswer, model: str | None = None, opt: OllamaOptions | None = None, sse: bool = False):
+    admit(model or DEFAULT_OLLAMA_MODEL)
+    return stream_response(ollama_provider.async_stream_rag_answer(
         query = query,
         model = model or DEFAULT_OLLAMA_MODEL,
         options=opt
-    ), media_type='text')
+    ), sse)
 
 
 
 # --- EMBENDDINGS ENDPOINTS --- 
 
 @app.post('/ollama/text/embenddings', tags=['text-embendding'])
-def text_embenddings(texts:list[str], model: str | None = None) -> list[list[float]]:
-    return ollama_provider.get_embendings(
+async def text_embenddings(texts:list[str], model: str | None = None) -> list[list[float]]:
+    # requests from different clients are merged to one embed call
+    return (await ollama_provider.embedding_batcher.embed(
         texts=texts, 
         model = model or DEFAULT_OLLAMA_EMB_MODEL
-    ).tolist()
+    )).tolist()
 
 
 
 # --- IMAGE ENDPOINTS ---
 
+async def fetch_images(urls: list[str]) -> list[bytes]:
+    # all images are downloaded concurrently
+    try:
+        return await image_fetcher.fetch_all(urls)
+    except ImageFetchError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+
 @app.post('/ollama/image/answer', tags=['images'])
-def image_answer_by_url(query: str, urls: list[str], model: str | None = None) -> Answer:
-    imgs_b: list[bytes] = []
-    for url in urls:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        imgs_b.append(resp.content)
-
-    answer = ollama_provider.answer(
+async def image_answer_by_url(query: str, urls: list[str], model: str | None = None) -> Answer:
+    imgs_b: list[bytes] = await fetch_images(urls)
+
+    answer = await ollama_provider.async_answer(
         query = ImageAnswer(
             query=query,
             paths=imgs_b
@@ -106,17 +173,13 @@ def image_answer_by_url(query: str, urls: list[str], model: str | None = None) -
 
 
 @app.post('/ollama/image/image-answer/', tags=['images'])
-def image_answer_by_imageanswer_with_url(query: ImageAnswer, model: str | None = None) -> Answer:
-    imgs_b: list[bytes] = []
-    for url in query.paths:
-        resp = requests.get(str(url))
-        resp.raise_for_status()
-        imgs_b.append(resp.content)
+async def image_answer_by_imageanswer_with_url(query: ImageAnswer, model: str | None = None) -> Answer:
+    imgs_b: list[bytes] = await fetch_images(query.paths)
     
     urls = query.paths
     query.paths = imgs_b
 
-    answer = ollama_provider.answer(
+    answer = await ollama_provider.async_answer(
         query = query,
         model=model or DEFAULT_OLLAMA_IMG_MODEL
     )
@@ -127,48 +190,62 @@ def image_answer_by_imageanswer_with_url(query: ImageAnswer, model: str | None =
 
 
 @app.post('/ollama/image/answer/stream', tags=['images-stream'])
-def stream_image_answer_by_url(query: str, urls: list[str], model: str | None = None):
-    imgs_b: list[bytes] = []
-    for url in urls:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        imgs_b.append(resp.content)
-
-    return StreamingResponse(ollama_provider.stream_answer(
+async def stream_image_answer_by_url(query: str, urls: list[str], model: str | None = None, sse: bool = False):
+    admit(model or DEFAULT_OLLAMA_IMG_MODEL)
+    imgs_b: list[bytes] = await fetch_images(urls)
+
+    return stream_response(ollama_provider.async_stream_answer(
         query = ImageAnswer(
             query=query,
             paths=imgs_b
         ),
         model=model or DEFAULT_OLLAMA_IMG_MODEL
-    ), media_type='text')
+    ), sse)
 
 
 
 
 @app.post('/ollama/image/image-answer/stream', tags=['images-stream'])
-def stream_image_answer_by_imageanswer_with_url(query: ImageAnswer, model: str | None = None):
-    imgs_b: list[bytes] = []
-    for url in query.paths:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        imgs_b.append(resp.content)
+async def stream_image_answer_by_imageanswer_with_url(query: ImageAnswer, model: str | None = None, sse: bool = False):
+    admit(model or DEFAULT_OLLAMA_IMG_MODEL)
+    imgs_b: list[bytes] = await fetch_images(query.paths)
 
     query.paths = imgs_b
 
-    return StreamingResponse(ollama_provider.stream_answer(
+    return stream_response(ollama_provider.async_stream_answer(
         query = query,
         model=model or DEFAULT_OLLAMA_IMG_MODEL
-    ), media_type='text')
+    ), sse)
+
+
+
+
+# --- METRICS ---
+
+@app.get('/metrics', tags=['metrics'], response_class=PlainTextResponse)
+async def metrics() -> str:
+    # prometheus text format
+    return ollama_provider.metrics_registry.render()
 
 
 
 
 @app.post('/pipeline/main/thread', tags=['agentic-pipeline'])
-def main_pipeline(query: QueryPipeline, model: str | None = None):
-    return StreamingResponse(pipeline_provider.main_pipeline(
-        query=query
-    ), media_type='application/x-ndjson')
-    #), media_type='text')
+async def main_pipeline(query: QueryPipeline, model: str | None = None, sse: bool = False):
+    # pipeline stages are still blocking (pdf, web parsing, vector db),
+    # starlette iterates this sync generator in threadpool
+    admit(PIPELINE_MODEL)
+    lines = pipeline_provider.main_pipeline(query=query)
+    # client sends it back to continue conversation on the same collection
+    headers = {'X-Conversation-Id': query.conversation_id}
+    if sse:
+        # every ndjson line is sent as one event
+        return StreamingResponse(
+            to_sse(line.rstrip("\n") for line in lines), 
+            media_type='text/event-stream', 
+            headers={**headers, 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    return StreamingResponse(lines, media_type='application/x-ndjson', headers=headers)
 
 
 
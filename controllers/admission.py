@@ -0,0 +1,261 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Iterator
+
+from .metrics import model_label, registry
+from .ollama_pool import normalize_model
+
+
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+ADMISSION_REJECTED = registry.counter("admission_rejected_total", "Ollama calls rejected by admission control", ("model", "reason"))
+ADMISSION_WAIT = registry.histogram("admission_wait_seconds", "Time ollama calls waited for model slot", ("model",), buckets=WAIT_BUCKETS)
+
+
+
+class Overloaded(Exception):
+    """ Model has no free slot and its wait queue is full, or wait passed deadline. """
+
+    def __init__(self, model: str, reason: str, retry_after: int):
+        super().__init__(f"Model {model} is overloaded ({reason}), retry after {retry_after}s")
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+
+class Waiter:
+    """ Queued call, `wake` is called by call which gives its slot to this one. """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None):
+        # slot was handed over, set under lock of gate
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future: asyncio.Future | None = loop.create_future() if loop is not None else None
+
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+
+class ModelGate:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # sync and async calls share one FIFO queue
+        self.queue: deque[Waiter] = deque()
+        # moving average of time one call holds slot, for Retry-After
+        self.hold_seconds = 1.0
+        self.lock = threading.Lock()
+
+
+    @property
+    def waiting(self) -> int:
+        return len(self.queue)
+
+
+
+def parse_limits(value: str) -> dict[str, int]:
+    """ "llama3=4,gemma3:27b=1" -> {"llama3:latest": 4, "gemma3:27b": 1} """
+    limits: dict[str, int] = {}
+    for item in value.split(","):
+        if "=" in item:
+            model, limit = item.rsplit("=", 1)
+            limits[normalize_model(model.strip())] = int(limit)
+    return limits
+
+
+
+class AdmissionController:
+    """
+    Concurrency limit per model with bounded wait queue.
+
+    Call takes slot of its model, when all `limit` slots are busy it waits in queue
+    of at most `max_queue` calls for `queue_timeout` seconds. Full queue and passed
+    deadline raise `Overloaded` with Retry-After estimated from slot hold time,
+    so overload fails fast instead of piling up requests inside ollama.
+    """
+
+    def __init__(self, limits: dict[str, int] | None = None, default_limit: int = 4,
+                 max_queue: int = 32, queue_timeout: float = 30):
+        self.limits = {normalize_model(model): limit for model, limit in (limits or {}).items()}
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._gates: dict[str, ModelGate] = {}
+        self._lock = threading.Lock()
+
+        registry.gauge(
+            "admission_queue_depth", "Ollama calls waiting for model slot", ("model",),
+            callback=lambda: self._by_label(lambda gate: gate.waiting),
+        )
+        registry.gauge(
+            "admission_active", "Ollama calls holding model slot", ("model",),
+            callback=lambda: self._by_label(lambda gate: gate.active),
+        )
+
+
+    def gates(self) -> list[tuple[str, ModelGate]]:
+        with self._lock:
+            return list(self._gates.items())
+
+
+    def _by_label(self, value: Callable[[ModelGate], int]) -> dict[tuple, int]:
+        # gates of models over label cap are summed into one series
+        result: dict[tuple, int] = {}
+        for model, gate in self.gates():
+            label = (model_label(model),)
+            result[label] = result.get(label, 0) + value(gate)
+        return result
+
+
+    def _gate(self, model: str) -> ModelGate:
+        model = normalize_model(model)
+        with self._lock:
+            if model not in self._gates:
+                self._gates[model] = ModelGate(self.limits.get(model, self.default_limit))
+            return self._gates[model]
+
+
+    def limit(self, model: str) -> int:
+        """ Number of calls of model that can hold slot at once. """
+        return self._gate(model).limit
+
+
+    def _retry_after(self, gate: ModelGate) -> int:
+        # queue ahead of new call is drained by `limit` slots
+        return max(1, math.ceil(gate.hold_seconds * (gate.waiting + 1) / max(gate.limit, 1)))
+
+
+    def _reject(self, model: str, gate: ModelGate, reason: str) -> Overloaded:
+        ADMISSION_REJECTED.labels(model_label(model), reason).inc()
+        return Overloaded(model, reason, self._retry_after(gate))
+
+
+    def check(self, model: str) -> None:
+        """
+        Fail fast when queue of model is already full, without taking slot.
+        Used before streaming response is started, later error could not change its status.
+        """
+        gate = self._gate(model)
+        with gate.lock:
+            if gate.active >= gate.limit and gate.waiting >= self.max_queue:
+                raise self._reject(model, gate, "queue_full")
+
+
+    def _try_enter(self, model: str, gate: ModelGate, waiter: Waiter) -> bool:
+        """ Take free slot, or put waiter to queue. Called under lock of gate. """
+        # new call does not overtake queued calls
+        if gate.active < gate.limit and not gate.queue:
+            gate.active += 1
+            return True
+        if gate.waiting >= self.max_queue:
+            raise self._reject(model, gate, "queue_full")
+        gate.queue.append(waiter)
+        return False
+
+
+    def _leave_queue(self, gate: ModelGate, waiter: Waiter) -> bool:
+        """ Waiter gives up, returns True if slot was handed to it meanwhile. """
+        with gate.lock:
+            if waiter.granted:
+                return True
+            gate.queue.remove(waiter)
+            return False
+
+
+    def _release(self, gate: ModelGate, held: float | None) -> None:
+        with gate.lock:
+            if held is not None:
+                gate.hold_seconds = 0.8 * gate.hold_seconds + 0.2 * held
+            if gate.queue:
+                # slot goes directly to first queued call, `active` stays the same
+                waiter = gate.queue.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                gate.active -= 1
+
+
+    def _enter(self, model: str, gate: ModelGate) -> None:
+        start = time.monotonic()
+        waiter = Waiter()
+        with gate.lock:
+            entered = self._try_enter(model, gate, waiter)
+
+        if not entered and not waiter.event.wait(self.queue_timeout):
+            if not self._leave_queue(gate, waiter):
+                raise self._reject(model, gate, "timeout")
+        ADMISSION_WAIT.labels(model_label(model)).observe(time.monotonic() - start)
+
+
+    async def _async_enter(self, model: str, gate: ModelGate) -> None:
+        start = time.monotonic()
+        waiter = Waiter(asyncio.get_running_loop())
+        with gate.lock:
+            entered = self._try_enter(model, gate, waiter)
+
+        if not entered:
+            try:
+                await asyncio.wait_for(waiter.future, self.queue_timeout)
+            except asyncio.TimeoutError:
+                if not self._leave_queue(gate, waiter):
+                    raise self._reject(model, gate, "timeout")
+            except asyncio.CancelledError:
+                # slot handed over together with cancel is given to next call
+                if self._leave_queue(gate, waiter):
+                    self._release(gate, None)
+                raise
+        ADMISSION_WAIT.labels(model_label(model)).observe(time.monotonic() - start)
+
+
+    @contextmanager
+    def acquire(self, model: str) -> Iterator[None]:
+        gate = self._gate(model)
+        self._enter(model, gate)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(gate, time.monotonic() - start)
+
+
+    @asynccontextmanager
+    async def async_acquire(self, model: str) -> AsyncIterator[None]:
+        gate = self._gate(model)
+        # waits on event loop, slots are shared with sync calls from threadpool
+        await self._async_enter(model, gate)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(gate, time.monotonic() - start)
+
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    admission = AdmissionController({"llama3": 2}, max_queue=2, queue_timeout=1)
+
+    def call(idx: int) -> str:
+        try:
+            with admission.acquire("llama3"):
+                time.sleep(0.3)
+            return f"{idx}: ok"
+        except Overloaded as e:
+            return f"{idx}: {e}"
+
+    with ThreadPoolExecutor(8) as executor:
+        for result in executor.map(call, range(8)):
+            print(result)
@@ -0,0 +1,162 @@
+import threading
+from functools import lru_cache
+from typing import Any, Callable
+
+from .metrics import registry
+
+
+# max context of model families, real window is also limited by num_ctx of ollama
+MODEL_CONTEXT_WINDOW: dict[str, int] = {
+    "llama3": 8192,
+    "llama3.1": 131072,
+    "llama3.2": 131072,
+    "gemma3": 131072,
+    "moondream": 2048,
+}
+
+# rough tokens estimate when tokenizer is not available (offline node)
+CHARS_PER_TOKEN = 4
+
+CONTEXT_CHUNKS = registry.counter("rag_context_chunks_total", "Retrieved chunks by packing result", ("result",))
+CONTEXT_TOKENS = registry.histogram(
+    "rag_context_tokens", "Tokens of packed RAG context",
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+).labels()
+
+
+
+def load_pretrained(name: str):
+    from tokenizers import Tokenizer
+    return Tokenizer.from_pretrained(name)
+
+
+
+class TokenCounter:
+    """
+    Count tokens with huggingface tokenizer returned by `loader`, loaded on first use
+    or ahead with `load` (loading can download files). Counts of texts are cached,
+    same chunks come back on every turn of conversation.
+    """
+
+    def __init__(self, loader: Callable[[], Any] | None = None, cache_size: int = 16384):
+        self.loader = loader
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+
+    @property
+    def tokenizer(self):
+        if not self._loaded:
+            self.load()
+        return self._tokenizer
+
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            if self.loader is not None:
+                try:
+                    self._tokenizer = self.loader()
+                except Exception as e:
+                    print(f"Tokenizer is not available ({e}), tokens are estimated from length")
+            self._loaded = True
+
+
+    def _count(self, text: str) -> int:
+        if self.tokenizer is None:
+            return -(-len(text) // CHARS_PER_TOKEN)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+    def truncate(self, text: str, tokens: int) -> str:
+        """ First `tokens` tokens of text. """
+        if self.tokenizer is None:
+            return text[:tokens * CHARS_PER_TOKEN]
+        offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+        if len(offsets) <= tokens:
+            return text
+        return text[:offsets[tokens - 1][1]] if tokens > 0 else ""
+
+
+
+class PackedContext:
+    def __init__(self, context: list[str], tokens: int, budget: int, dropped: int, trimmed: int):
+        self.context = context
+        self.tokens = tokens
+        self.budget = budget
+        self.dropped = dropped
+        self.trimmed = trimmed
+
+
+    def __str__(self) -> str:
+        return f"{len(self.context)} chunks, {self.tokens}/{self.budget} tokens, {self.trimmed} trimmed, {self.dropped} dropped"
+
+
+
+class ContextPacker:
+    """
+    Fit retrieved chunks to token budget of model.
+
+    Budget is context window minus prompt without context and minus tokens reserved
+    for answer. Chunks are taken by rank while they fit, chunk which does not fit
+    is trimmed when at least `min_trim_tokens` are left, otherwise it is dropped.
+    """
+
+    def __init__(self, counter: TokenCounter, num_ctx: int = 4096, answer_reserve: int = 1024,
+                 min_trim_tokens: int = 64, message_overhead: int = 8):
+        self.counter = counter
+        self.num_ctx = num_ctx
+        self.answer_reserve = answer_reserve
+        self.min_trim_tokens = min_trim_tokens
+        # role and template tokens added by ollama around every message
+        self.message_overhead = message_overhead
+
+
+    def context_window(self, model: str, num_ctx: int | None = None) -> int:
+        # "llama3:latest" -> "llama3"
+        window = MODEL_CONTEXT_WINDOW.get(model.split(":")[0], self.num_ctx)
+        return min(window, num_ctx or self.num_ctx)
+
+
+    def budget(self, model: str, prompt_messages: list[dict], num_ctx: int | None = None) -> int:
+        prompt_tokens = sum(
+            self.counter.count(message.get("content") or "") + self.message_overhead
+            for message in prompt_messages
+        )
+        return max(self.context_window(model, num_ctx) - self.answer_reserve - prompt_tokens, 0)
+
+
+    def pack(self, chunks: list[str], budget: int, scores: list[float] | None = None) -> PackedContext:
+        """ `chunks` are in rank order, or ranked by `scores` if they are given. """
+        order = range(len(chunks))
+        if scores is not None:
+            order = sorted(order, key=lambda idx: scores[idx], reverse=True)
+
+        packed: list[str] = []
+        used, dropped, trimmed = 0, 0, 0
+
+        for idx in order:
+            chunk = chunks[idx]
+            # chunks are joined by new line
+            tokens = self.counter.count(chunk) + 1
+            left = budget - used
+
+            if tokens <= left:
+                packed.append(chunk)
+                used += tokens
+            elif left - 1 >= self.min_trim_tokens:
+                packed.append(self.counter.truncate(chunk, left - 1))
+                used = budget
+                trimmed += 1
+            else:
+                dropped += 1
+
+        CONTEXT_CHUNKS.labels("kept").inc(len(packed) - trimmed)
+        CONTEXT_CHUNKS.labels("trimmed").inc(trimmed)
+        CONTEXT_CHUNKS.labels("dropped").inc(dropped)
+        CONTEXT_TOKENS.observe(used)
+
+        return PackedContext(packed, used, budget, dropped, trimmed)
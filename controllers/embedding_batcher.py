@@ -0,0 +1,122 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+import numpy as np
+
+from .metrics import registry
+
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+BATCH_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+
+class PendingBatch:
+    def __init__(self):
+        self.texts: list[str] = []
+        # (start, end, future) - slice of batch result for every waiting caller
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.opened: float = time.perf_counter()
+        self.timer: asyncio.Task | None = None
+
+
+    def add(self, texts: list[str], future: asyncio.Future) -> None:
+        start = len(self.texts)
+        self.texts += texts
+        self.waiters.append((start, len(self.texts), future))
+
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent embedding requests for the same model and sends them
+    as one embed call. Batch is sent when `max_wait_ms` passed since first
+    request in it, or when it holds at least `max_batch` inputs.
+    """
+
+    def __init__(self, embed: Callable[[list[str], str], Awaitable[np.ndarray]],
+                 max_wait_ms: float = 5, max_batch: int = 256):
+        self.embed_fn = embed
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+
+        self._pending: dict[str, PendingBatch] = {}
+        self._running: set[asyncio.Task] = set()
+
+        self.batch_size = registry.histogram(
+            "embedding_batch_size", "Inputs in one batched embed call", buckets=BATCH_SIZE_BUCKETS
+        ).labels()
+        self.batch_wait = registry.histogram(
+            "embedding_batch_wait_seconds", "Time first request of batch waited for flush", buckets=BATCH_LATENCY_BUCKETS
+        ).labels()
+        self.batch_latency = registry.histogram(
+            "embedding_batch_latency_seconds", "Duration of batched embed call", buckets=BATCH_LATENCY_BUCKETS
+        ).labels()
+
+
+    async def embed(self, texts: list[str], model: str) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        batch = self._pending.get(model)
+        if batch is None:
+            batch = self._pending[model] = PendingBatch()
+            batch.timer = asyncio.create_task(self._flush_later(model, batch))
+
+        future = asyncio.get_running_loop().create_future()
+        batch.add(texts, future)
+
+        if len(batch.texts) >= self.max_batch:
+            self._flush(model, batch)
+
+        return await future
+
+
+    async def _flush_later(self, model: str, batch: PendingBatch) -> None:
+        await asyncio.sleep(self.max_wait)
+        self._flush(model, batch)
+
+
+    def _flush(self, model: str, batch: PendingBatch) -> None:
+        # batch can be already sent by size limit before timer fired
+        if self._pending.get(model) is not batch:
+            return
+        del self._pending[model]
+
+        if batch.timer is not None and batch.timer is not asyncio.current_task():
+            batch.timer.cancel()
+
+        task = asyncio.create_task(self._send(model, batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+
+    async def _send(self, model: str, batch: PendingBatch) -> None:
+        started = time.perf_counter()
+        self.batch_size.observe(len(batch.texts))
+        self.batch_wait.observe(started - batch.opened)
+
+        try:
+            vectors = await self.embed_fn(batch.texts, model)
+        except Exception as e:
+            for _, _, future in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.batch_latency.observe(time.perf_counter() - started)
+
+        for start, end, future in batch.waiters:
+            # caller could be cancelled (client disconnected) while waiting
+            if not future.done():
+                future.set_result(vectors[start:end])
+
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "batch_size": self.batch_size.snapshot,
+            "batch_wait_seconds": self.batch_wait.snapshot,
+            "batch_latency_seconds": self.batch_latency.snapshot,
+        }
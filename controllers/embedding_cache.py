@@ -0,0 +1,290 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+
+# size of one record in index file (blake2b digest of text)
+DIGEST_SIZE = 16
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+
+class DiskStore:
+    """
+    Append-only on-disk storage of embeddings for a single model.
+
+    Files in the model directory:
+      - vectors.f32 : float32 matrix, one row per stored text
+      - index.bin   : text digests, record `i` is digest of row `i`
+      - meta.json   : vector dimension
+      - lock        : flock of writers, directory is shared by workers of server
+
+    Vectors are read through np.memmap. Rows appended or compacted by other
+    processes are picked up by `refresh`, row of new text is taken from size
+    of file under exclusive lock.
+    """
+
+    def __init__(self, path: Path, max_rows: int):
+        self.path = path
+        self.max_rows = max_rows
+        self.dim: int | None = None
+        self.index: dict[bytes, int] = {}
+        self.rows: int = 0
+        self._map: np.memmap | None = None
+        # inodes of files that index and map were read from, compaction replaces them
+        self._inodes: tuple[int, int] | None = None
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+
+    @property
+    def vectors_path(self) -> Path: return self.path / "vectors.f32"
+
+    @property
+    def index_path(self) -> Path: return self.path / "index.bin"
+
+    @property
+    def meta_path(self) -> Path: return self.path / "meta.json"
+
+    @property
+    def lock_path(self) -> Path: return self.path / "lock"
+
+
+    @contextmanager
+    def _locked(self, mode: int) -> Iterator[None]:
+        with open(self.lock_path, "a+b") as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+    def _load(self) -> None:
+        with self._locked(fcntl.LOCK_EX):
+            if not self.meta_path.exists():
+                return
+            self.dim = int(json.loads(self.meta_path.read_text())["dim"])
+
+            # process can be killed between two appends, keep only complete rows
+            self._truncate(self._complete_rows())
+            self._sync()
+
+
+    def _complete_rows(self) -> int:
+        index_rows = self.index_path.stat().st_size // DIGEST_SIZE if self.index_path.exists() else 0
+        vec_rows = self.vectors_path.stat().st_size // (self.dim * 4) if self.vectors_path.exists() else 0
+        return min(index_rows, vec_rows)
+
+
+    def _truncate(self, rows: int) -> None:
+        with open(self.index_path, "ab") as f:
+            f.truncate(rows * DIGEST_SIZE)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(rows * self.dim * 4)
+
+
+    def _sync(self) -> None:
+        """ Catch up with files written by other processes, called under file lock. """
+        if self.dim is None:
+            if not self.meta_path.exists():
+                return
+            self.dim = int(json.loads(self.meta_path.read_text())["dim"])
+        if not self.vectors_path.exists() or not self.index_path.exists():
+            return
+
+        inodes = (self.vectors_path.stat().st_ino, self.index_path.stat().st_ino)
+        rows = self._complete_rows()
+        replaced = inodes != self._inodes or rows < self.rows
+        if replaced:
+            # files were compacted, index is read again
+            self._inodes = inodes
+            self.index = {}
+            self.rows = 0
+
+        if rows > self.rows:
+            with open(self.index_path, "rb") as f:
+                f.seek(self.rows * DIGEST_SIZE)
+                digests = f.read((rows - self.rows) * DIGEST_SIZE)
+            for i in range(rows - self.rows):
+                self.index[digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]] = self.rows + i
+            self.rows = rows
+
+        # map is opened together with index, so both describe the same file
+        if self.rows == 0:
+            self._map = None
+        elif replaced or self._map is None or self._map.shape[0] != self.rows:
+            self._map = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+
+
+    def refresh(self) -> None:
+        with self._locked(fcntl.LOCK_SH):
+            self._sync()
+
+
+    def get(self, digest: bytes) -> np.ndarray | None:
+        row = self.index.get(digest)
+        if row is None:
+            return None
+        return np.array(self._map[row])
+
+
+    def append(self, digests: list[bytes], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        # batch bigger than store keeps only its newest rows
+        if len(digests) > self.max_rows:
+            digests, vectors = digests[len(digests) - self.max_rows:], vectors[len(digests) - self.max_rows:]
+
+        with self._locked(fcntl.LOCK_EX):
+            self._sync()
+
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self.meta_path.write_text(json.dumps({"dim": self.dim}))
+                self._truncate(0)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match stored dimension {self.dim}")
+
+            # other process could store same texts meanwhile
+            new_rows = [idx for idx, digest in enumerate(digests) if digest not in self.index]
+            if not new_rows:
+                return
+            digests, vectors = [digests[idx] for idx in new_rows], vectors[new_rows]
+
+            if self.rows + len(digests) > self.max_rows:
+                self._compact(max(self.max_rows * 3 // 4 - len(digests), 0))
+
+            # vectors are written first, so index never points to missing row
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.index_path, "ab") as f:
+                f.write(b"".join(digests))
+
+            self._sync()
+
+
+    def compact(self, keep: int) -> None:
+        """ Evict oldest rows, only newest `keep` rows stay on disk. """
+        with self._locked(fcntl.LOCK_EX):
+            self._sync()
+            self._compact(keep)
+
+
+    def _compact(self, keep: int) -> None:
+        start = max(self.rows - keep, 0)
+        kept = np.array(self._map[start:]) if self._map is not None else np.empty((0, self.dim), dtype=np.float32)
+        digests = self.index_path.read_bytes()[start * DIGEST_SIZE:self.rows * DIGEST_SIZE]
+
+        tmp_vectors = self.vectors_path.with_suffix(".tmp")
+        tmp_index = self.index_path.with_suffix(".tmp")
+        tmp_vectors.write_bytes(kept.tobytes())
+        tmp_index.write_bytes(digests)
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_index, self.index_path)
+
+        self._map = None
+        self._sync()
+
+
+
+class EmbeddingCache:
+    """
+    Content addressed embedding cache, key is (model, hash of text).
+
+    In-memory LRU is checked first, then the on-disk store of the model.
+    With `path=None` cache works only in memory.
+    """
+
+    def __init__(self, path: Path | None, memory_size: int = 10_000, max_disk_rows: int = 200_000):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_disk_rows = max_disk_rows
+
+        self._memory: OrderedDict[tuple[str, bytes], np.ndarray] = OrderedDict()
+        self._stores: dict[str, DiskStore] = {}
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def _store(self, model: str) -> DiskStore | None:
+        if self.path is None:
+            return None
+        if model not in self._stores:
+            self._stores[model] = DiskStore(
+                self.path / re.sub(r"[^A-Za-z0-9._-]", "_", model), self.max_disk_rows
+            )
+        return self._stores[model]
+
+
+    def _remember(self, key: tuple[str, bytes], vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+
+    def get_many(self, model: str, texts: list[str]) -> list[np.ndarray | None]:
+        result: list[np.ndarray | None] = []
+
+        with self._lock:
+            store = self._store(model)
+            if store is not None:
+                store.refresh()
+            for text in texts:
+                key = (model, text_digest(text))
+
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                else:
+                    vector = store.get(key[1]) if store is not None else None
+                    if vector is not None:
+                        self._remember(key, vector)
+                        self.disk_hits += 1
+                    else:
+                        self.misses += 1
+
+                result.append(vector)
+
+        return result
+
+
+    def put_many(self, model: str, texts: list[str], vectors: np.ndarray) -> None:
+        digests = [text_digest(text) for text in texts]
+
+        with self._lock:
+            store = self._store(model)
+            new_rows = [idx for idx, digest in enumerate(digests) if store is not None and digest not in store.index]
+            if new_rows:
+                store.append([digests[idx] for idx in new_rows], vectors[new_rows])
+
+            for digest, vector in zip(digests, vectors):
+                self._remember((model, digest), np.array(vector, dtype=np.float32))
+
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_size": len(self._memory),
+            "disk_rows": sum(store.rows for store in self._stores.values()),
+        }
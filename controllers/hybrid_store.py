@@ -0,0 +1,173 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from .vector_store import VectorStore
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    # product names and error codes (E1234, 0x80070005) stay whole tokens
+    return TOKEN_RE.findall(text.lower())
+
+
+
+class BM25Index:
+    """ Incremental BM25 (Okapi) over chunks of one collection. """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        self.texts: list[str] = []
+        self.lengths: list[int] = []
+        self.total_length = 0
+        # term -> {chunk index: term frequency}
+        self.postings: dict[str, dict[int, int]] = {}
+        self._lock = threading.Lock()
+
+
+    def add(self, texts: list[str]) -> None:
+        with self._lock:
+            for text in texts:
+                idx = len(self.texts)
+                tokens = tokenize(text)
+                self.texts.append(text)
+                self.lengths.append(len(tokens))
+                self.total_length += len(tokens)
+                for term, freq in Counter(tokens).items():
+                    self.postings.setdefault(term, {})[idx] = freq
+
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        with self._lock:
+            count = len(self.texts)
+            if count == 0:
+                return []
+            avg_length = self.total_length / count
+
+            scores: dict[int, float] = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for idx, freq in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[idx] / avg_length)
+                    scores[idx] = scores.get(idx, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self.texts[idx], score) for idx, score in top]
+
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """ Fuse ranked lists of texts, score of text is sum of 1 / (k + rank) over lists. """
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, text in enumerate(ranking, start=1):
+            scores[text] = scores.get(text, 0.0) + 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+
+class HybridVectorStore(VectorStore):
+    """
+    Dense store with in-process BM25 index of the same chunks.
+
+    Search takes `candidates` results of dense and sparse retrieval and fuses them
+    with reciprocal rank fusion. Sparse index is kept only for collections created
+    by this process, index of collection written before restart (or by another
+    replica) would miss its older chunks and rank new ones first, search of such
+    collection stays dense only. HTTP store returns at most top k of FAISS service,
+    `candidates` over it do not add dense results.
+    """
+
+    def __init__(self, store: VectorStore, candidates: int = 30, rrf_k: int = 60):
+        self.store = store
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+        # only complete indexes, collection without index is searched dense only
+        self._indexes: dict[str, BM25Index] = {}
+        self._lock = threading.Lock()
+
+
+    def _add(self, name: str, texts: list[str]) -> None:
+        with self._lock:
+            index = self._indexes.get(name)
+        if index is not None:
+            index.add(texts)
+
+
+    def collections(self) -> list[str]:
+        return self.store.collections()
+
+
+    def exists(self, name: str) -> bool:
+        return self.store.exists(name)
+
+
+    def create(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        self.store.create(name, vectors, texts)
+        with self._lock:
+            self._indexes[name] = BM25Index()
+        self._add(name, texts)
+
+
+    def append(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        self.store.append(name, vectors, texts)
+        self._add(name, texts)
+
+
+    def upsert(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        if not texts:
+            return
+        created = not self.store.exists(name)
+        self.store.upsert(name, vectors, texts)
+        if created:
+            with self._lock:
+                self._indexes.setdefault(name, BM25Index())
+        self._add(name, texts)
+
+
+    def search(self, name: str, query: np.ndarray, k: int, text: str | None = None) -> list[dict]:
+        dense = self.store.search(name, query, max(k, self.candidates))
+
+        with self._lock:
+            index = self._indexes.get(name)
+        if text is None or index is None:
+            return dense[:k]
+
+        sparse = index.search(text, max(k, self.candidates))
+        fused = reciprocal_rank_fusion(
+            [[item["text"] for item in dense], [chunk for chunk, _ in sparse]],
+            self.rrf_k,
+        )
+        return [{"text": chunk, "score": score} for chunk, score in fused[:k]]
+
+
+    def delete(self, name: str) -> None:
+        self.store.delete(name)
+        with self._lock:
+            self._indexes.pop(name, None)
+
+
+    def trim(self, name: str, keep: int) -> None:
+        self.store.trim(name, keep)
+        with self._lock:
+            index = self._indexes.get(name)
+        if index is None or len(index.texts) <= keep:
+            return
+
+        # trim is rare, index of kept chunks is simply rebuilt
+        trimmed = BM25Index(index.k1, index.b)
+        trimmed.add(index.texts[len(index.texts) - keep:] if keep > 0 else [])
+        with self._lock:
+            self._indexes[name] = trimmed
@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+
+
+class ImageFetchError(ValueError):
+    def __init__(self, url: str, message: str, status_code: int = 400):
+        super().__init__(f"Image {url}: {message}")
+        self.url = url
+        self.status_code = status_code
+
+
+
+class ImageFetcher:
+    """
+    Download images concurrently with one pooled http client.
+
+    Every download has timeout, body is limited to `max_bytes` while it is streamed,
+    response must have image content type.
+    """
+
+    def __init__(self, timeout: float = 10, max_bytes: int = 20 * 1024 * 1024, max_connections: int = 64):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_connections = max_connections
+        self._client: httpx.AsyncClient | None = None
+
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # created lazily, client must live in the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_connections),
+            )
+        return self._client
+
+
+    async def fetch(self, url: str) -> bytes:
+        try:
+            async with self.client.stream("GET", url) as resp:
+                if resp.status_code >= 400:
+                    raise ImageFetchError(url, f"server responded with {resp.status_code}", 502)
+
+                content_type = resp.headers.get("content-type", "")
+                if not content_type.startswith("image/"):
+                    raise ImageFetchError(url, f"content type '{content_type}' is not an image", 415)
+
+                length = resp.headers.get("content-length")
+                if length is not None and length.isdigit() and int(length) > self.max_bytes:
+                    raise ImageFetchError(url, f"image is larger than {self.max_bytes} bytes", 413)
+
+                chunks: list[bytes] = []
+                size = 0
+                async for chunk in resp.aiter_bytes():
+                    size += len(chunk)
+                    # content-length can be missing or wrong, count real bytes
+                    if size > self.max_bytes:
+                        raise ImageFetchError(url, f"image is larger than {self.max_bytes} bytes", 413)
+                    chunks.append(chunk)
+
+                return b"".join(chunks)
+
+        except httpx.TimeoutException:
+            raise ImageFetchError(url, f"download took more than {self.timeout}s", 504)
+        except httpx.HTTPError as e:
+            raise ImageFetchError(url, f"download failed ({e})", 502)
+
+
+    async def fetch_all(self, urls: list[str]) -> list[bytes]:
+        """ Download all urls at once, order of result is same as order of urls. """
+        tasks = [asyncio.ensure_future(self.fetch(str(url))) for url in urls]
+        try:
+            return list(await asyncio.gather(*tasks))
+        finally:
+            # first failure (or cancel of request) stops downloads which are still running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
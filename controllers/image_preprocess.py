@@ -0,0 +1,106 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+# vision encoders work on small fixed resolution, bigger images only inflate payload
+MODEL_MAX_EDGE: dict[str, int] = {
+    "moondream": 768,
+    "gemma3": 896,
+    "llava": 672,
+    "llama3.2-vision": 1120,
+}
+
+
+
+class ImagePreprocessor:
+    """
+    Downscale images to max edge of the vision model and re-encode them to JPEG.
+    Processed bytes are cached by (content hash, max edge).
+    """
+
+    def __init__(self, default_max_edge: int = 1024, quality: int = 85, max_cache_bytes: int = 64 * 1024 * 1024):
+        self.default_max_edge = default_max_edge
+        self.quality = quality
+        self.max_cache_bytes = max_cache_bytes
+
+        self._cache: OrderedDict[tuple[bytes, int], bytes] = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+
+    def max_edge(self, model: str) -> int:
+        # "gemma3:27b" -> "gemma3"
+        return MODEL_MAX_EDGE.get(model.split(":")[0], self.default_max_edge)
+
+
+    def process(self, data: bytes, model: str) -> bytes:
+        max_edge = self.max_edge(model)
+        key = (hashlib.blake2b(data, digest_size=16).digest(), max_edge)
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        result = self._resize(data, max_edge)
+
+        with self._lock:
+            self._cache[key] = result
+            self._cache_bytes += len(result)
+            while self._cache_bytes > self.max_cache_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+        return result
+
+
+    def _resize(self, data: bytes, max_edge: int) -> bytes:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image_format = image.format
+            # phone photos keep orientation in EXIF, it is lost after re-encode
+            image = ImageOps.exif_transpose(image)
+        except (UnidentifiedImageError, OSError):
+            # not an image for Pillow, let ollama decide what to do with it
+            return data
+
+        resized = max(image.size) > max_edge
+        if not resized and image_format in ("JPEG", "PNG"):
+            return data
+
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=self.quality, optimize=True)
+        result = buffer.getvalue()
+
+        # downscaled image is always sent, even if compact source (PNG screenshot) was smaller in bytes
+        if resized:
+            return result
+        return result if len(result) < len(data) else data
+
+
+    def prepare_messages(self, messages: list[dict], model: str) -> list[dict]:
+        """ Replace images (bytes or paths) in chat messages with processed bytes. """
+        for message in messages:
+            if not message.get("images"):
+                continue
+            message["images"] = [
+                self.process(image.read_bytes() if isinstance(image, Path) else image, model)
+                if isinstance(image, (bytes, Path)) else image
+                for image in message["images"]
+            ]
+        return messages
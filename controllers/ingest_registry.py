@@ -0,0 +1,96 @@
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+
+def content_digest(data: bytes | str | Path) -> str:
+    if isinstance(data, Path):
+        data = data.read_bytes()
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+
+class IngestRegistry:
+    """
+    Hashes of documents and chunks already stored in every collection.
+
+    Kept in memory, optionally backed by sqlite file. File should be used only
+    with vector store that outlives the process (FAISS service),
+    otherwise registry remembers documents that store has lost.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = path
+
+        # collection -> (document digests, chunk digests), loaded from file on first use
+        self._collections: dict[str, tuple[set[str], set[str]]] = {}
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS documents (collection TEXT, digest TEXT, PRIMARY KEY (collection, digest))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS chunks (collection TEXT, digest TEXT, PRIMARY KEY (collection, digest))")
+            self._db.commit()
+
+
+    def _get(self, collection: str) -> tuple[set[str], set[str]]:
+        # called under lock
+        if collection not in self._collections:
+            documents: set[str] = set()
+            chunks: set[str] = set()
+            if self._db is not None:
+                documents = {row[0] for row in self._db.execute("SELECT digest FROM documents WHERE collection = ?", (collection,))}
+                chunks = {row[0] for row in self._db.execute("SELECT digest FROM chunks WHERE collection = ?", (collection,))}
+            self._collections[collection] = (documents, chunks)
+        return self._collections[collection]
+
+
+    def has_document(self, collection: str, digest: str) -> bool:
+        with self._lock:
+            return digest in self._get(collection)[0]
+
+
+    def add_document(self, collection: str, digest: str) -> None:
+        with self._lock:
+            self._get(collection)[0].add(digest)
+            if self._db is not None:
+                self._db.execute("INSERT OR IGNORE INTO documents VALUES (?, ?)", (collection, digest))
+                self._db.commit()
+
+
+    def unseen_chunks(self, collection: str, chunks: Iterable[str]) -> Iterator[str]:
+        """ Skip chunks stored in collection before and repeated chunks of this stream. """
+        seen: set[str] = set()
+        for chunk in chunks:
+            digest = content_digest(chunk)
+            with self._lock:
+                known = digest in self._get(collection)[1]
+            if known or digest in seen:
+                continue
+            seen.add(digest)
+            yield chunk
+
+
+    def add_chunks(self, collection: str, chunks: list[str]) -> None:
+        digests = [content_digest(chunk) for chunk in chunks]
+        with self._lock:
+            self._get(collection)[1].update(digests)
+            if self._db is not None:
+                self._db.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?)", [(collection, digest) for digest in digests])
+                self._db.commit()
+
+
+    def forget(self, collection: str) -> None:
+        """ Collection was deleted or lost by vector store. """
+        with self._lock:
+            self._collections.pop(collection, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM documents WHERE collection = ?", (collection,))
+                self._db.execute("DELETE FROM chunks WHERE collection = ?", (collection,))
+                self._db.commit()
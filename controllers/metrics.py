@@ -0,0 +1,269 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from .ollama_pool import normalize_model
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# model comes from request parameters, distinct model label values are capped,
+# models seen after the cap is reached are counted as "other"
+METRICS_MAX_MODELS = int(os.environ.get("METRICS_MAX_MODELS", 32))
+
+_model_labels: set[str] = set()
+_model_labels_lock = threading.Lock()
+
+
+
+def model_label(model: str) -> str:
+    """ Label value of model, "llama3" and "llama3:latest" are one series. """
+    model = normalize_model(model)
+    with _model_labels_lock:
+        if model in _model_labels:
+            return model
+        if len(_model_labels) < METRICS_MAX_MODELS:
+            _model_labels.add(model)
+            return model
+    return "other"
+
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed upper bounds of buckets,
+    same semantic as prometheus histogram.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[idx] += 1
+
+
+    @property
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": dict(zip(self.buckets, self.counts)),
+                "count": self.count,
+                "sum": self.sum,
+            }
+
+
+
+def escape_label(value: str) -> str:
+    """ Escape label value as text exposition format requires. """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+
+class MetricFamily:
+    """ One metric name with children per label values. """
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: tuple[str, ...],
+                 factory: Callable[[], Any], callback: Callable[[], dict[tuple, float]] | None = None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = labelnames
+        self.factory = factory
+        # values are read from callback at render time (stats of caches, pool, ...)
+        self.callback = callback
+
+        self.children: dict[tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+
+    def labels(self, *values: str) -> Any:
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}")
+
+        with self._lock:
+            if values not in self.children:
+                self.children[values] = self.factory()
+            return self.children[values]
+
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+        if self.callback is not None:
+            for values, value in self.callback().items():
+                lines.append(f"{self.name}{format_labels(self.labelnames, values)} {value}")
+            return lines
+
+        with self._lock:
+            children = list(self.children.items())
+
+        for values, child in children:
+            if isinstance(child, Histogram):
+                snapshot = child.snapshot
+                for bound, count in snapshot["buckets"].items():
+                    bucket_labels = format_labels(self.labelnames, values, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                bucket_labels = format_labels(self.labelnames, values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {snapshot['count']}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, values)} {snapshot['sum']}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, values)} {snapshot['count']}")
+            else:
+                lines.append(f"{self.name}{format_labels(self.labelnames, values)} {child.value}")
+
+        return lines
+
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families: dict[str, MetricFamily] = {}
+        self._lock = threading.Lock()
+
+
+    def _family(self, name: str, help: str, kind: str, labelnames: tuple[str, ...],
+                factory: Callable[[], Any], callback: Callable[[], dict[tuple, float]] | None = None) -> MetricFamily:
+        with self._lock:
+            # same metric can be requested from several places
+            if name not in self._families:
+                self._families[name] = MetricFamily(name, help, kind, labelnames, factory, callback)
+            return self._families[name]
+
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                callback: Callable[[], dict[tuple, float]] | None = None) -> MetricFamily:
+        return self._family(name, help, "counter", labelnames, Counter, callback)
+
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+              callback: Callable[[], dict[tuple, float]] | None = None) -> MetricFamily:
+        return self._family(name, help, "gauge", labelnames, Gauge, callback)
+
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> MetricFamily:
+        return self._family(name, help, "histogram", labelnames, lambda: Histogram(buckets))
+
+
+    def render(self) -> str:
+        """ Prometheus text exposition format. """
+        with self._lock:
+            families = list(self._families.values())
+        return "\n".join(line for family in families for line in family.render()) + "\n"
+
+
+
+registry = MetricsRegistry()
+
+
+# --- llm call metrics, labels: model and call site (router, planner, rag_answer, ...) ---
+
+LLM_REQUESTS = registry.counter("llm_requests_total", "LLM requests by result status", ("model", "site", "status"))
+LLM_REQUEST_SECONDS = registry.histogram("llm_request_seconds", "Wall time of LLM request in our process", ("model", "site"))
+LLM_TTFT_SECONDS = registry.histogram("llm_time_to_first_token_seconds", "Time to first streamed token", ("model", "site"))
+LLM_LOAD_SECONDS = registry.histogram("llm_load_seconds", "Model load time reported by ollama", ("model", "site"))
+LLM_PROMPT_EVAL_SECONDS = registry.histogram("llm_prompt_eval_seconds", "Prompt processing time reported by ollama", ("model", "site"))
+LLM_EVAL_SECONDS = registry.histogram("llm_eval_seconds", "Generation time reported by ollama", ("model", "site"))
+LLM_PROMPT_TOKENS = registry.counter("llm_prompt_tokens_total", "Prompt tokens processed by ollama", ("model", "site"))
+LLM_COMPLETION_TOKENS = registry.counter("llm_completion_tokens_total", "Tokens generated by ollama", ("model", "site"))
+
+
+
+class LLMCall:
+    def __init__(self, model: str, site: str):
+        self.model = model_label(model)
+        self.site = site
+        self.started = time.perf_counter()
+        self.first_token: float | None = None
+        # ollama response (or last stream chunk) with timings
+        self.response: Any = None
+
+
+    def token(self) -> None:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+            LLM_TTFT_SECONDS.labels(self.model, self.site).observe(self.first_token - self.started)
+
+
+    def finish(self, status: str) -> None:
+        labels = (self.model, self.site)
+        LLM_REQUESTS.labels(*labels, status).inc()
+        LLM_REQUEST_SECONDS.labels(*labels).observe(time.perf_counter() - self.started)
+
+        if self.response is None:
+            return
+
+        # durations from ollama are in nanoseconds
+        for family, field in (
+            (LLM_LOAD_SECONDS, "load_duration"),
+            (LLM_PROMPT_EVAL_SECONDS, "prompt_eval_duration"),
+            (LLM_EVAL_SECONDS, "eval_duration"),
+        ):
+            value = getattr(self.response, field, None)
+            if value is not None:
+                family.labels(*labels).observe(value / 1e9)
+
+        if getattr(self.response, "prompt_eval_count", None) is not None:
+            LLM_PROMPT_TOKENS.labels(*labels).inc(self.response.prompt_eval_count)
+        if getattr(self.response, "eval_count", None) is not None:
+            LLM_COMPLETION_TOKENS.labels(*labels).inc(self.response.eval_count)
+
+
+
+@contextmanager
+def track_llm_call(model: str, site: str) -> Iterator[LLMCall]:
+    call = LLMCall(model, site)
+    try:
+        yield call
+    except (GeneratorExit, asyncio.CancelledError):
+        # stream was closed by consumer or task cancelled (client disconnected)
+        call.finish("cancelled")
+        raise
+    except BaseException:
+        call.finish("error")
+        raise
+    else:
+        call.finish("ok")
@@ -1,26 +1,74 @@
 #import ollama
 import os
-from ollama import Client
 from ollama._types import ChatResponse
+from .ollama_pool import OllamaPool
+from .admission import AdmissionController, Overloaded, parse_limits
+from .response_cache import ResponseCache, is_deterministic
+from .metrics import registry, model_label, track_llm_call, LLM_REQUESTS
 from pathlib import Path
 from pydantic import BaseModel
 import numpy as np
+import inspect
 from typing import Any, Callable
 
 
-print("ENVIRON", os.environ.get("OLLAMA_HOST", "localhost:11434"))
+# comma separated list of ollama hosts, single OLLAMA_HOST is still supported
+OLLAMA_HOSTS: list[str] = [
+    host.strip() for host in os.environ.get(
+        "OLLAMA_HOSTS", os.environ.get("OLLAMA_HOST", "localhost:11434")
+    ).split(",") if host.strip()
+]
 
-ollama = Client(
-    host = os.environ.get("OLLAMA_HOST", "localhost:11434")
+print("ENVIRON", OLLAMA_HOSTS)
+
+# every request takes host (with sync and async client) from pool
+pool = OllamaPool(
+    hosts = OLLAMA_HOSTS,
+    max_failures = int(os.environ.get("OLLAMA_MAX_FAILURES", 3)),
+    eject_seconds = float(os.environ.get("OLLAMA_EJECT_SECONDS", 30)),
+)
+
+# concurrent calls per model, e.g. OLLAMA_MODEL_CONCURRENCY="llama3=4,gemma3:27b=1,all-minilm=16",
+# calls over limit wait in queue of ADMISSION_MAX_QUEUE for ADMISSION_QUEUE_TIMEOUT seconds
+admission = AdmissionController(
+    limits = parse_limits(os.environ.get("OLLAMA_MODEL_CONCURRENCY", "")),
+    default_limit = int(os.environ.get("OLLAMA_DEFAULT_CONCURRENCY", 4)),
+    max_queue = int(os.environ.get("ADMISSION_MAX_QUEUE", 32)),
+    queue_timeout = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 30)),
+)
+
+# cache of temperature=0 structured responses, call site enable it with `cache=True`
+response_cache = ResponseCache(
+    ttl = float(os.environ.get("RESPONSE_CACHE_TTL", 3600)),
+    max_entries = int(os.environ.get("RESPONSE_CACHE_SIZE", 4096)),
+    path = Path(os.environ["RESPONSE_CACHE_PATH"]) if os.environ.get("RESPONSE_CACHE_PATH") else None,
+    max_disk_entries = int(os.environ.get("RESPONSE_CACHE_DISK_SIZE", 100_000)),
 )
 
 
-def answer(messages: list[dict[str, str]], model: str, options: dict[str, Any] | None) -> dict[str, str]:
+registry.gauge(
+    "ollama_host_outstanding_requests", "Requests in flight per ollama host", ("host",),
+    callback=lambda: {(host["host"],): host["outstanding"] for host in pool.stats},
+)
+registry.gauge(
+    "ollama_host_available", "1 if host is not ejected from pool", ("host",),
+    callback=lambda: {(host["host"],): int(host["available"]) for host in pool.stats},
+)
+registry.counter(
+    "response_cache_requests_total", "Response cache lookups by result", ("result",),
+    callback=lambda: {("hit",): response_cache.hits, ("miss",): response_cache.misses},
+)
+
+
+def answer(messages: list[dict[str, str]], model: str, options: dict[str, Any] | None,
+        conversation_id: str | None = None, site: str = "default") -> dict[str, str]:
     kwargs = dict() 
     if options is not None:
         kwargs['options'] = options
         
-    response: ChatResponse = ollama.chat(model, messages, **kwargs)
+    with admission.acquire(model), pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+        response: ChatResponse = host.client.chat(model, messages, **kwargs)
+        call.response = response
     output = { 
         'role': response.message.role,
         'content': response.message.content
@@ -33,15 +81,21 @@ def answer(messages: list[dict[str, str]], model: str, options: dict[str, Any] |
 
 
 
-def stream_answer(messages: list[dict[str, str]], model: str, options: dict[str, Any] | None):
+def stream_answer(messages: list[dict[str, str]], model: str, options: dict[str, Any] | None,
+        conversation_id: str | None = None, site: str = "default"):
     kwargs = dict() 
     if options is not None:
         kwargs['options'] = options
     # parameter to ollama for set stream
     kwargs['stream'] = True
         
-    for token in ollama.chat(model, messages=messages, **kwargs):
-        yield token['message']['content']
+    with admission.acquire(model), pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+        for token in host.client.chat(model, messages=messages, **kwargs):
+            call.token()
+            # last chunk of stream has timings and token counts
+            if token.done:
+                call.response = token
+            yield token['message']['content']
             
     
 
@@ -49,29 +103,104 @@ def stream_answer(messages: list[dict[str, str]], model: str, options: dict[str,
 
 
 
-def json_answer(messages: list[dict[str, str]], model: str, format: type[BaseModel], options: dict[str, Any] | None) -> BaseModel:
+def json_answer(messages: list[dict[str, str]], model: str, format: type[BaseModel], options: dict[str, Any] | None,
+        conversation_id: str | None = None, cache: bool = False, site: str = "default") -> BaseModel:
     kwargs = dict() 
     if options is not None:
         kwargs['options'] = options
 
-    response: ChatResponse = ollama.chat(
-        messages= messages,
-        model=model,
-        format=format.model_json_schema(),
-        **kwargs
-    )
+    # only deterministic calls can be answered from cache
+    cache_key = None
+    if cache and is_deterministic(options):
+        cache_key = response_cache.key(model=model, messages=messages, format=format.model_json_schema(), options=options)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            LLM_REQUESTS.labels(model_label(model), site, "cached").inc()
+            return format.model_validate_json(cached)
+
+    with admission.acquire(model), pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+        response: ChatResponse = host.client.chat(
+            messages= messages,
+            model=model,
+            format=format.model_json_schema(),
+            **kwargs
+        )
+        call.response = response
 
     if response.message.content is None:
         raise ValueError("Error when generating structure output message")
 
+    result = format.model_validate_json(response.message.content)
+    # cache only responses that are valid for format
+    if cache_key is not None:
+        response_cache.set(cache_key, response.message.content)
+
+    return result
+
+
+def generate(prompt: str, model: str, system: str | None = None, format: dict[str, Any] | None = None,
+        options: dict[str, Any] | None = None, conversation_id: str | None = None, cache: bool = False,
+        site: str = "default") -> str:
+    kwargs = dict()
+    if options is not None:
+        kwargs['options'] = options
+
+    cache_key = None
+    if cache and is_deterministic(options):
+        cache_key = response_cache.key(model=model, prompt=prompt, system=system, format=format, options=options)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            LLM_REQUESTS.labels(model_label(model), site, "cached").inc()
+            return cached
+
+    with admission.acquire(model), pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+        response = host.client.generate(
+            model=model,
+            prompt=prompt,
+            system=system,
+            format=format,
+            stream=False,
+            **kwargs
+        )
+        call.response = response
+
+    if cache_key is not None:
+        response_cache.set(cache_key, response["response"])
+
+    return response["response"]
+
+
+
+def get_embedding(text: str, model: str, site: str = "embeddings") -> np.ndarray:
+    with admission.acquire(model), pool.acquire(model) as host, track_llm_call(model, site) as call:
+        result = host.client.embed(model, text)
+        call.response = result
+    return parse_embedding(result, model)
 
 
-    return format.model_validate_json(response.message.content)
 
+def get_embeddings(texts: list[str], model: str, site: str = "embeddings") -> list[list[float]]:
+    # one request for all texts, ollama keep order of inputs in response
+    with admission.acquire(model), pool.acquire(model) as host, track_llm_call(model, site) as call:
+        result = host.client.embed(model, texts)
+        call.response = result
+    return parse_embeddings(result, texts, model)
 
-def get_embedding(text: str, model: str) -> np.ndarray:
-    result = ollama.embed(model, text)
 
+
+def parse_embeddings(result: Any, texts: list[str], model: str) -> list[list[float]]:
+    emb = result["embeddings"] if "embeddings" in result else None
+
+    if not isinstance(emb, list) or len(emb) != len(texts):
+        raise ValueError(
+            f"Model '{model}' returned {len(emb) if isinstance(emb, list) else 0} embeddings for {len(texts)} inputs"
+        )
+
+    return emb
+
+
+
+def parse_embedding(result: Any, model: str) -> np.ndarray:
     # 1) Моделі типу all-minilm, nomic, mxbai -> embeddings=[[vector]]
     if "embeddings" in result:
         emb = result["embeddings"]
@@ -97,7 +226,8 @@ def get_embedding(text: str, model: str) -> np.ndarray:
 
 
 
-def tool_calling(messages: list[dict[str, str]], tools: dict[str, Callable], model: str, options: dict[str, Any] | None) -> list[dict[str, str]]:
+def tool_calling(messages: list[dict[str, str]], tools: dict[str, Callable], model: str, options: dict[str, Any] | None,
+        conversation_id: str | None = None, site: str = "default") -> list[dict[str, str]]:
     kwargs = dict() 
     if options is not None:
         kwargs['options'] = options
@@ -107,12 +237,152 @@ def tool_calling(messages: list[dict[str, str]], tools: dict[str, Callable], mod
     messages_start_length = len(messages)
 
     while True:
-        response: ChatResponse = ollama.chat(
-            messages= messages,
-            model=model,
-            tools = tools_func, 
-            **kwargs
-        )
+        with admission.acquire(model), pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+            response: ChatResponse = host.client.chat(
+                messages= messages,
+                model=model,
+                tools = tools_func, 
+                **kwargs
+            )
+            call.response = response
+        messages.append({
+            'role': response.message.role,
+            'content': response.message.content
+        })
+        if response.message.thinking: messages[-1]['thinking'] = response.message.thinking
+
+        if response.message.tool_calls:
+            for tc in response.message.tool_calls:
+                if tc.function.name in tools:
+                    result = tools[tc.function.name](**tc.function.arguments)
+                    messages.append({
+                        'role': 'tool', 
+                        'tool_name': tc.function.name, 
+                        'content': str(result)
+                    })
+
+        else: break
+
+
+    return messages[messages_start_length:]
+
+
+
+
+# --- async twins of the functions above, they use `async_ollama` client ---
+
+async def async_answer(messages: list[dict[str, str]], model: str, options: dict[str, Any] | None,
+        conversation_id: str | None = None, site: str = "default") -> dict[str, str]:
+    kwargs = dict() 
+    if options is not None:
+        kwargs['options'] = options
+        
+    async with admission.async_acquire(model):
+        with pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+            response: ChatResponse = await host.async_client.chat(model, messages, **kwargs)
+            call.response = response
+    output = { 
+        'role': response.message.role,
+        'content': response.message.content
+    }
+    
+    if response.message.thinking: output['thinking'] = response.message.thinking
+
+    return output
+
+
+
+async def async_stream_answer(messages: list[dict[str, str]], model: str, options: dict[str, Any] | None,
+        conversation_id: str | None = None, site: str = "default"):
+    kwargs = dict() 
+    if options is not None:
+        kwargs['options'] = options
+    # parameter to ollama for set stream
+    kwargs['stream'] = True
+        
+    async with admission.async_acquire(model):
+        with pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+            async for token in await host.async_client.chat(model, messages=messages, **kwargs):
+                call.token()
+                if token.done:
+                    call.response = token
+                yield token['message']['content']
+
+
+
+async def async_json_answer(messages: list[dict[str, str]], model: str, format: type[BaseModel], options: dict[str, Any] | None,
+        conversation_id: str | None = None, cache: bool = False, site: str = "default") -> BaseModel:
+    kwargs = dict() 
+    if options is not None:
+        kwargs['options'] = options
+
+    cache_key = None
+    if cache and is_deterministic(options):
+        cache_key = response_cache.key(model=model, messages=messages, format=format.model_json_schema(), options=options)
+        cached = await response_cache.async_get(cache_key)
+        if cached is not None:
+            LLM_REQUESTS.labels(model_label(model), site, "cached").inc()
+            return format.model_validate_json(cached)
+
+    async with admission.async_acquire(model):
+        with pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+            response: ChatResponse = await host.async_client.chat(
+                messages= messages,
+                model=model,
+                format=format.model_json_schema(),
+                **kwargs
+            )
+            call.response = response
+
+    if response.message.content is None:
+        raise ValueError("Error when generating structure output message")
+
+    result = format.model_validate_json(response.message.content)
+    if cache_key is not None:
+        await response_cache.async_set(cache_key, response.message.content)
+
+    return result
+
+
+
+async def async_get_embedding(text: str, model: str, site: str = "embeddings") -> np.ndarray:
+    async with admission.async_acquire(model):
+        with pool.acquire(model) as host, track_llm_call(model, site) as call:
+            result = await host.async_client.embed(model, text)
+            call.response = result
+    return parse_embedding(result, model)
+
+
+
+async def async_get_embeddings(texts: list[str], model: str, site: str = "embeddings") -> list[list[float]]:
+    async with admission.async_acquire(model):
+        with pool.acquire(model) as host, track_llm_call(model, site) as call:
+            result = await host.async_client.embed(model, texts)
+            call.response = result
+    return parse_embeddings(result, texts, model)
+
+
+
+async def async_tool_calling(messages: list[dict[str, str]], tools: dict[str, Callable], model: str, options: dict[str, Any] | None,
+        conversation_id: str | None = None, site: str = "default") -> list[dict[str, str]]:
+    kwargs = dict() 
+    if options is not None:
+        kwargs['options'] = options
+    
+    tools_func: list[Callable] = [tools[i] for i in tools]
+
+    messages_start_length = len(messages)
+
+    while True:
+        async with admission.async_acquire(model):
+            with pool.acquire(model, conversation_id) as host, track_llm_call(model, site) as call:
+                response: ChatResponse = await host.async_client.chat(
+                    messages= messages,
+                    model=model,
+                    tools = tools_func, 
+                    **kwargs
+                )
+                call.response = response
         messages.append({
             'role': response.message.role,
             'content': response.message.content
@@ -123,6 +393,9 @@ def tool_calling(messages: list[dict[str, str]], tools: dict[str, Callable], mod
             for tc in response.message.tool_calls:
                 if tc.function.name in tools:
                     result = tools[tc.function.name](**tc.function.arguments)
+                    # tools can be coroutine functions as well
+                    if inspect.isawaitable(result):
+                        result = await result
                     messages.append({
                         'role': 'tool', 
                         'tool_name': tc.function.name, 
@@ -0,0 +1,200 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+
+import httpx
+from ollama import AsyncClient, Client, ResponseError
+
+
+def normalize_model(model: str) -> str:
+    # ollama list models with tag, "llama3" and "llama3:latest" are same model
+    return model if ":" in model else f"{model}:latest"
+
+
+
+class OllamaHost:
+    def __init__(self, host: str):
+        self.host = host
+        self.client = Client(host=host)
+        self.async_client = AsyncClient(host=host)
+
+        self.outstanding: int = 0
+        self.failures: int = 0
+        self.ejected_until: float = 0.0
+        # None - models on host are unknown, host is treated as having any model
+        self.models: set[str] | None = None
+
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+    def has_model(self, model: str) -> bool:
+        return self.models is None or normalize_model(model) in self.models
+
+
+    def __repr__(self) -> str:
+        return f"OllamaHost({self.host}, outstanding={self.outstanding}, failures={self.failures})"
+
+
+
+class OllamaPool:
+    """
+    Pool of ollama hosts.
+
+    - picks host with least outstanding requests among hosts that have the model,
+    - keeps conversation on the same host (ollama reuse KV cache for same prefix),
+    - ejects host after `max_failures` consecutive failures for `eject_seconds`,
+      after that host gets requests again and is ejected at first new failure.
+    """
+
+    def __init__(self, hosts: list[str], max_failures: int = 3, eject_seconds: float = 30,
+                 max_conversations: int = 10_000):
+        if not hosts:
+            raise ValueError("Ollama pool requires at least one host")
+
+        self.hosts = [OllamaHost(host) for host in hosts]
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.max_conversations = max_conversations
+
+        self._affinity: OrderedDict[str, OllamaHost] = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def refresh_models(self) -> None:
+        """ Ask every host which models it has, unreachable hosts are counted as failed. """
+        for host in self.hosts:
+            try:
+                models = {normalize_model(m.model) for m in host.client.list().models if m.model}
+            except Exception:
+                self._failed(host)
+                continue
+            with self._lock:
+                host.models = models
+
+
+    def pick(self, model: str, conversation_id: str | None = None) -> OllamaHost:
+        with self._lock:
+            now = time.monotonic()
+
+            if conversation_id is not None:
+                host = self._affinity.get(conversation_id)
+                if host is not None and host.available(now) and host.has_model(model):
+                    self._affinity.move_to_end(conversation_id)
+                    return host
+
+            candidates = [host for host in self.hosts if host.available(now)]
+            if not candidates:
+                # every host is ejected, try one which will be back first
+                candidates = [min(self.hosts, key=lambda host: host.ejected_until)]
+
+            # if nobody has model, let some host to pull/load it
+            candidates = [host for host in candidates if host.has_model(model)] or candidates
+            host = min(candidates, key=lambda host: host.outstanding)
+
+            if conversation_id is not None:
+                self._affinity[conversation_id] = host
+                self._affinity.move_to_end(conversation_id)
+                while len(self._affinity) > self.max_conversations:
+                    self._affinity.popitem(last=False)
+
+            return host
+
+
+    def _failed(self, host: OllamaHost) -> None:
+        with self._lock:
+            host.failures += 1
+            if host.failures >= self.max_failures:
+                host.ejected_until = time.monotonic() + self.eject_seconds
+
+
+    def _succeeded(self, host: OllamaHost, model: str) -> None:
+        with self._lock:
+            host.failures = 0
+            host.ejected_until = 0.0
+            if host.models is not None:
+                host.models.add(normalize_model(model))
+
+
+    @contextmanager
+    def acquire(self, model: str, conversation_id: str | None = None) -> Iterator[OllamaHost]:
+        """
+        Reserve host for one request, use `host.client` or `host.async_client` inside.
+        Network errors and ollama 5xx responses are counted as host failures.
+        """
+        host = self.pick(model, conversation_id)
+        with self._lock:
+            host.outstanding += 1
+
+        try:
+            yield host
+        except (httpx.TransportError, ConnectionError) as e:
+            self._failed(host)
+            raise e
+        except ResponseError as e:
+            if e.status_code >= 500:
+                self._failed(host)
+            elif e.status_code == 404 and host.models is not None:
+                # model not found on this host
+                with self._lock:
+                    host.models.discard(normalize_model(model))
+            raise e
+        else:
+            self._succeeded(host, model)
+        finally:
+            with self._lock:
+                host.outstanding -= 1
+
+
+    @property
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "host": host.host,
+                "outstanding": host.outstanding,
+                "failures": host.failures,
+                "available": host.available(now),
+                "models": sorted(host.models) if host.models is not None else None,
+            }
+            for host in self.hosts
+        ]
+
+
+
+
+if __name__ == "__main__":
+    # manual test with few local fake ollama servers
+    # run from repo root: python -m controllers.ollama_pool
+    from tests.fake_ollama import start_fake_ollama
+
+    servers = [
+        start_fake_ollama(models=["llama3:latest", "all-minilm:latest"]),
+        start_fake_ollama(models=["llama3:latest"]),
+        start_fake_ollama(models=["gemma3:27b"]),
+    ]
+    pool = OllamaPool([f"http://127.0.0.1:{srv.server_port}" for srv in servers], eject_seconds=1)
+    pool.refresh_models()
+
+    for i in range(4):
+        with pool.acquire("llama3", conversation_id=f"conv-{i % 2}") as host:
+            print(f"conv-{i % 2} ->", host.host, host.client.chat("llama3", [{"role": "user", "content": "hi"}]).message.content)
+
+    with pool.acquire("gemma3:27b") as host:
+        print("gemma3:27b ->", host.host)
+
+    # stop first server, after `max_failures` errors it is ejected
+    servers[0].shutdown()
+    servers[0].server_close()
+    for _ in range(4):
+        try:
+            with pool.acquire("all-minilm", conversation_id="conv-0") as host:
+                host.client.embed("all-minilm", "hello")
+                print("embed on", host.host)
+        except Exception as e:
+            print("failed:", type(e).__name__)
+
+    print(pool.stats)
@@ -41,57 +41,96 @@ import io
 # )
 
 
+# also counts tokens of rag context (see views.ollama.context_packer)
+tokenizer = AutoTokenizer.from_pretrained("isaacus/kanon-tokenizer", force_download=True)
+
 chunker = semchunk.chunkerify(
-    AutoTokenizer.from_pretrained("isaacus/kanon-tokenizer", force_download=True),
+    tokenizer,
     512,  # maximal token size for chunk
 )
 
 
-def read_pdf(pdf_path: Path | bytes) -> list[str]:
+def open_pdf(pdf_path: Path | bytes | str) -> PdfReader:
     if isinstance(pdf_path, Path):
-        reader = PdfReader(pdf_path)
-    else:
-        if isinstance(pdf_path, bytes):
-            pdf_path = pdf_path.decode("utf-8")  # или нужная тебе кодировка
+        return PdfReader(pdf_path)
 
-            # если это data URL: "data:application/pdf;base64,...."
-        if pdf_path.startswith("data:"):
-            pdf_b64 = pdf_path.split(",", 1)[1]
-        else:
-            pdf_b64 = pdf_path  # уже чистый base64
+    if isinstance(pdf_path, bytes):
+        pdf_path = pdf_path.decode("utf-8")  # или нужная тебе кодировка
 
-        buffer = base64.b64decode(pdf_b64)
-        f = io.BytesIO(buffer)
-        reader = PdfReader(f)
+        # если это data URL: "data:application/pdf;base64,...."
+    if pdf_path.startswith("data:"):
+        pdf_b64 = pdf_path.split(",", 1)[1]
+    else:
+        pdf_b64 = pdf_path  # уже чистый base64
 
+    buffer = base64.b64decode(pdf_b64)
+    f = io.BytesIO(buffer)
+    return PdfReader(f)
 
 
-    all_text: str = ""
+def page_text(page) -> str:
+    text: str = ""
+    for row in page.extract_text(exctraction_mode="layout").split("\n"):
+        if len(row) < 3:
+            continue
+        text += row
+        if row[-1] == "-":
+            text += ""
+        else:
+            text += " "
+    return text
 
-    for page in reader.pages:
-        for row in page.extract_text(exctraction_mode="layout").split("\n"):
-            if len(row) < 3:
-                continue
-            all_text += row
-            if row[-1] == "-":
-                all_text += ""
-            else:
-                all_text += " "
 
+def chunk_text(text: str) -> list[str]:
     split_sent: list[str] = []
-    for sent in all_text.split("."):
+    for sent in text.split("."):
         if not len(sent.strip()):
             continue
         split_sent.append(sent.strip())
 
+    if not split_sent:
+        return []
+
     # --- old(and bad) text chunker ---
     # result: list[str] = [ ". ".join(split_sent[_:_+30]) for _ in range(0, len(split_sent), 30) ]
 
     return [text for text in chunker(". ".join(split_sent)) if len(text) > 70]
 
+
+def read_pdf(pdf_path: Path | bytes) -> list[str]:
+    reader = open_pdf(pdf_path)
+
+    all_text: str = "".join(page_text(page) for page in reader.pages)
+
+    return chunk_text(all_text)
+
     # return result
 
 
+def iter_pdf_chunks(pdf_path: Path | bytes, window_pages: int = 8):
+    """
+    Chunks like `read_pdf`, but text is chunked every `window_pages` pages,
+    so memory does not grow with document size. Unfinished last sentence
+    of window is carried to the next one.
+    """
+    reader = open_pdf(pdf_path)
+    carry: str = ""
+
+    for idx, page in enumerate(reader.pages, start=1):
+        carry += page_text(page)
+        if idx % window_pages:
+            continue
+
+        cut = carry.rfind(".")
+        if cut < 0:
+            continue
+
+        complete, carry = carry[:cut], carry[cut + 1:]
+        yield from chunk_text(complete)
+
+    yield from chunk_text(carry)
+
+
 # def docling_read_pdf(pdf_path: Path) -> list[str]:
 #    return converter.convert(pdf_path).document.export_to_markdown()
 
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+
+def is_deterministic(options: dict[str, Any] | None) -> bool:
+    # with default temperature ollama sample tokens, same input gives different output
+    return options is not None and options.get("temperature") == 0
+
+
+
+class ResponseCache:
+    """
+    Cache for raw llm responses of deterministic calls.
+
+    In-memory LRU with TTL, optionally backed by sqlite file
+    (entries from file are used after process restart). File keeps at most
+    `max_disk_entries` rows, expired and oldest written rows are pruned while
+    process runs. Async callers use `async_get` / `async_set`, sqlite is not
+    read or written on event loop.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 4096, path: Path | None = None,
+                 max_disk_entries: int = 100_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        # table is pruned every 1% of cap writes, not on every insert
+        self._prune_every = max(max_disk_entries // 100, 1)
+        self._writes = 0
+
+        # key -> (expire time, response)
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+            self._prune()
+
+
+    @staticmethod
+    def key(**request: Any) -> str:
+        # images in messages are bytes, they are hashed by repr
+        raw = json.dumps(request, sort_keys=True, default=repr)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT expires, value FROM responses WHERE key = ?", (key,)).fetchone()
+                entry = (row[0], row[1]) if row is not None else None
+                if entry is not None:
+                    self._remember(key, entry)
+
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    self._memory.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+
+    def set(self, key: str, value: str) -> None:
+        entry = (time.time() + self.ttl, value)
+
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, *entry))
+                self._writes += 1
+                if self._writes >= self._prune_every:
+                    self._prune()
+                else:
+                    self._db.commit()
+
+
+    def _prune(self) -> None:
+        """ Drop expired rows and oldest rows over `max_disk_entries`. Called under lock. """
+        self._writes = 0
+        self._db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+        # ttl is the same for all rows, smallest expires are the oldest writes
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+        self._db.commit()
+
+
+    async def async_get(self, key: str) -> str | None:
+        if self._db is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+
+    async def async_set(self, key: str, value: str) -> None:
+        if self._db is None:
+            self.set(key, value)
+        else:
+            await asyncio.to_thread(self.set, key, value)
+
+
+    def _remember(self, key: str, entry: tuple[float, str]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._memory)}
@@ -0,0 +1,245 @@
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+from .metrics import registry
+from .vector_store import VectorStore
+
+
+
+class Session:
+    def __init__(self, conversation_id: str):
+        self.conversation_id = conversation_id
+        # collection name -> vectors stored by this process
+        self.collections: dict[str, int] = {}
+        self.created = time.time()
+        self.last_active = self.created
+
+
+    @property
+    def vectors(self) -> int:
+        return sum(self.collections.values())
+
+
+
+class SessionStore:
+    """
+    Activity and size of every conversation.
+
+    Collection over `max_vectors` is compacted before next upsert (oldest vectors
+    are dropped, or whole collection is deleted if store can not trim, as FAISS
+    service, then conversation loses all its earlier chunks).
+    Conversations idle for `idle_ttl` seconds lose their collections, cleanup runs
+    in background thread every `cleanup_interval` seconds. Collections already in store
+    when cleanup starts (left by previous run) are tracked as active from that moment.
+    `on_evict` callbacks are called with collection name when its vectors are removed
+    (e.g. to forget cached artifacts of collection).
+    """
+
+    def __init__(self, store: VectorStore, idle_ttl: float = 24 * 3600, max_vectors: int = 50_000,
+                 cleanup_interval: float = 300):
+        self.store = store
+        self.idle_ttl = idle_ttl
+        self.max_vectors = max_vectors
+        self.cleanup_interval = cleanup_interval
+        self.on_evict: list[Callable[[str], None]] = []
+
+        self._sessions: dict[str, Session] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # collection -> number of evictions, ingest checks it did not lose vectors meanwhile
+        self._generations: dict[str, int] = {}
+
+        self.expired = 0
+        self.compacted = 0
+
+        registry.gauge("sessions_active", "Conversations tracked by session store", callback=lambda: {(): len(self._sessions)})
+        registry.gauge("session_vectors", "Vectors stored for tracked conversations", callback=lambda: {(): self.total_vectors})
+        registry.counter(
+            "session_evictions_total", "Collections removed by session store", ("reason",),
+            callback=lambda: {("expired",): self.expired, ("compacted",): self.compacted},
+        )
+
+
+    @property
+    def total_vectors(self) -> int:
+        with self._lock:
+            return sum(session.vectors for session in self._sessions.values())
+
+
+    def touch(self, conversation_id: str) -> Session:
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                session = self._sessions[conversation_id] = Session(conversation_id)
+            session.last_active = time.time()
+            return session
+
+
+    def reserve(self, conversation_id: str, collection: str, count: int) -> None:
+        """ Make room for `count` new vectors in collection, called before upsert. """
+        session = self.touch(conversation_id)
+        with self._lock:
+            stored = session.collections.get(collection, 0)
+        if stored + count <= self.max_vectors:
+            return
+
+        keep = max(self.max_vectors - count, 0)
+        try:
+            self.store.trim(collection, keep)
+            kept = min(stored, keep)
+        except NotImplementedError:
+            # FAISS service can not drop rows, whole collection is deleted with all earlier chunks
+            print(f"Session store: collection {collection} over {self.max_vectors} vectors can not be trimmed, deleting it")
+            self.store.delete(collection)
+            kept = 0
+
+        with self._lock:
+            session.collections[collection] = kept
+        self.compacted += 1
+        self._evicted(collection)
+
+
+    def record(self, conversation_id: str, collection: str, count: int) -> None:
+        session = self.touch(conversation_id)
+        with self._lock:
+            session.collections[collection] = session.collections.get(collection, 0) + count
+
+
+    def drop(self, conversation_id: str, collection: str) -> None:
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is not None:
+                session.collections.pop(collection, None)
+
+
+    def expire(self) -> list[str]:
+        """ Delete collections of idle conversations, returns expired conversation ids. """
+        deadline = time.time() - self.idle_ttl
+        with self._lock:
+            expired = [session for session in self._sessions.values() if session.last_active < deadline]
+            for session in expired:
+                del self._sessions[session.conversation_id]
+
+        for session in expired:
+            for collection in session.collections:
+                try:
+                    self.store.delete(collection)
+                except Exception as e:
+                    print(f"Session cleanup: failed to delete collection {collection}: {e}")
+                self._evicted(collection)
+            self.expired += 1
+
+        return [session.conversation_id for session in expired]
+
+
+    def generation(self, collection: str) -> int:
+        """ Changes every time vectors of collection are removed. """
+        with self._lock:
+            return self._generations.get(collection, 0)
+
+
+    def seed(self) -> None:
+        """
+        Track collections which are already in store (FAISS service outlives this process),
+        they are active from now and expire as any other idle conversation.
+        """
+        try:
+            names = self.store.collections()
+        except Exception as e:
+            print(f"Session store: failed to list collections: {e}")
+            return
+
+        now = time.time()
+        with self._lock:
+            for name in names:
+                if name not in self._sessions:
+                    session = self._sessions[name] = Session(name)
+                    session.last_active = now
+                    # size is unknown, only vectors written by this process are counted
+                    session.collections[name] = 0
+
+
+    def _evicted(self, collection: str) -> None:
+        with self._lock:
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+        for callback in self.on_evict:
+            callback(collection)
+
+
+    def _run(self) -> None:
+        # listing remote store is not done in startup of server
+        self.seed()
+        while not self._stop.wait(self.cleanup_interval):
+            self.expire()
+
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="session-cleanup")
+            self._thread.start()
+
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+
+class SessionVectorStore(VectorStore):
+    """
+    Vector store which reports writes and searches to session store.
+    Pipelines use conversation id as collection name, so collection is owned
+    by conversation with the same id.
+    """
+
+    def __init__(self, store: VectorStore, sessions: SessionStore):
+        self.store = store
+        self.sessions = sessions
+
+
+    def collections(self) -> list[str]:
+        return self.store.collections()
+
+
+    def exists(self, name: str) -> bool:
+        return self.store.exists(name)
+
+
+    def create(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        self.sessions.reserve(name, name, len(texts))
+        self.store.create(name, vectors, texts)
+        self.sessions.record(name, name, len(texts))
+
+
+    def append(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        self.sessions.reserve(name, name, len(texts))
+        self.store.append(name, vectors, texts)
+        self.sessions.record(name, name, len(texts))
+
+
+    def upsert(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        self.sessions.reserve(name, name, len(texts))
+        self.store.upsert(name, vectors, texts)
+        self.sessions.record(name, name, len(texts))
+
+
+    def search(self, name: str, query: np.ndarray, k: int, text: str | None = None) -> list[dict]:
+        self.sessions.touch(name)
+        return self.store.search(name, query, k, text)
+
+
+    def delete(self, name: str) -> None:
+        self.store.delete(name)
+        self.sessions.drop(name, name)
+
+
+    def trim(self, name: str, keep: int) -> None:
+        self.store.trim(name, keep)
@@ -0,0 +1,363 @@
+import json
+import struct
+import threading
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# binary body: header (magic, rows, dim, metadata length), metadata json, rows * dim little-endian float32
+VECTORS_CONTENT_TYPE = "application/x-vectors"
+VECTORS_MAGIC = b"VEC1"
+VECTORS_HEADER = struct.Struct("<4sIII")
+
+# service without binary support rejects body with unsupported media type or validation error,
+# plain 400 is also answer to create of existing collection, it counts only when it names content type
+BINARY_REJECTED_STATUSES = (415, 422)
+BINARY_REJECTED_MARKERS = ("content type", "content-type", "media type", "unsupported")
+
+
+
+def binary_rejected(resp: requests.Response) -> bool:
+    if resp.status_code in BINARY_REJECTED_STATUSES:
+        return True
+    return resp.status_code == 400 and any(marker in resp.text.lower() for marker in BINARY_REJECTED_MARKERS)
+
+
+
+def encode_vectors(vectors: np.ndarray, metadata: dict | None = None) -> bytes:
+    vectors = np.asarray(vectors, dtype="<f4")
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    meta = json.dumps(metadata).encode() if metadata is not None else b""
+    rows, dim = vectors.shape
+    return VECTORS_HEADER.pack(VECTORS_MAGIC, rows, dim, len(meta)) + meta + np.ascontiguousarray(vectors).tobytes()
+
+
+
+def decode_vectors(body: bytes) -> tuple[np.ndarray, dict | None]:
+    magic, rows, dim, meta_len = VECTORS_HEADER.unpack_from(body)
+    if magic != VECTORS_MAGIC:
+        raise ValueError("Body is not in binary vectors format")
+
+    offset = VECTORS_HEADER.size
+    metadata = json.loads(body[offset:offset + meta_len]) if meta_len else None
+    offset += meta_len
+    if len(body) - offset != rows * dim * 4:
+        raise ValueError(f"Body size does not match vectors shape ({rows}, {dim})")
+
+    vectors = np.frombuffer(body, dtype="<f4", count=rows * dim, offset=offset).reshape(rows, dim)
+    return vectors, metadata
+
+
+class VectorStore:
+    """
+    Interface of vector storage used by pipelines.
+    Every vector has metadata dict, search returns metadata of top k vectors
+    (with "text" key) plus "score". `text` of query is used by stores with
+    lexical search, dense stores ignore it.
+    """
+
+    def collections(self) -> list[str]:
+        raise NotImplementedError
+
+    def create(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        raise NotImplementedError
+
+    def append(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        raise NotImplementedError
+
+    def search(self, name: str, query: np.ndarray, k: int, text: str | None = None) -> list[dict]:
+        raise NotImplementedError
+
+    def delete(self, name: str) -> None:
+        raise NotImplementedError
+
+
+    def exists(self, name: str) -> bool:
+        return name in self.collections()
+
+
+    def trim(self, name: str, keep: int) -> None:
+        """ Keep only `keep` newest vectors of collection. """
+        raise NotImplementedError
+
+
+    def upsert(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        """ Create collection or append to existing one. """
+        if name not in self.collections():
+            self.create(name, vectors, texts)
+        else:
+            self.append(name, vectors, texts)
+
+
+
+class HTTPVectorStore(VectorStore):
+    """
+    Client of external FAISS service.
+
+    Vectors are sent in binary format when `transport` is "binary" or "auto".
+    With "auto" first request tries binary body, if service rejects it
+    client switches to json for the rest of its life.
+
+    Connections are kept in pooled session. Names of collections are listed
+    from service once and then kept in local set, which is updated on create
+    and invalidated when service answers 404.
+    """
+
+    def __init__(self, url: str, transport: str = "auto", pool_size: int = 32):
+        if transport not in ("auto", "binary", "json"):
+            raise ValueError(f"Unknown vector transport '{transport}', expected 'auto', 'binary' or 'json'")
+        self.url = url.rstrip("/")
+        self.transport = transport
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # None - not loaded from service yet
+        self._known: set[str] | None = None
+        self._lock = threading.Lock()
+
+
+    def _send(self, method: str, path: str, vectors: np.ndarray, metadata: dict | None = None) -> requests.Response:
+        url = f"{self.url}{path}"
+
+        if self.transport != "json":
+            resp = self.session.request(
+                method, url,
+                data=encode_vectors(vectors, metadata),
+                headers={"Content-Type": VECTORS_CONTENT_TYPE},
+            )
+            if self.transport == "binary" or not binary_rejected(resp):
+                if self.transport == "auto" and resp.ok:
+                    self.transport = "binary"
+                return resp
+
+        if metadata is None:
+            resp = self.session.request(method, url, json=np.asarray(vectors).tolist())
+        else:
+            resp = self.session.request(method, url, json={"vectors": np.asarray(vectors).tolist(), "metadata": metadata})
+        # switch only when json was accepted where binary was not
+        if self.transport == "auto" and resp.ok:
+            self.transport = "json"
+        return resp
+
+
+    def _forget(self, name: str) -> None:
+        with self._lock:
+            if self._known is not None:
+                self._known.discard(name)
+
+
+    def _remember(self, name: str) -> None:
+        with self._lock:
+            if self._known is not None:
+                self._known.add(name)
+
+
+    def is_known(self, name: str) -> bool:
+        """ Check collection in local set, service is listed only on first call. """
+        if self._known is None:
+            names = self.collections()
+            with self._lock:
+                if self._known is None:
+                    self._known = set(names)
+        with self._lock:
+            return name in self._known
+
+
+    def exists(self, name: str) -> bool:
+        return self.is_known(name)
+
+
+    def collections(self) -> list[str]:
+        resp = self.session.get(f"{self.url}/faiss/collections")
+        resp.raise_for_status()
+        names = resp.json()
+        with self._lock:
+            self._known = set(names)
+        return names
+
+
+    def create(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        self._send("POST", f"/faiss/collection/{name}", vectors, {"text": texts}).raise_for_status()
+        self._remember(name)
+
+
+    def append(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        resp = self._send("PUT", f"/faiss/collection/{name}", vectors, {"text": texts})
+        if resp.status_code == 404:
+            self._forget(name)
+        resp.raise_for_status()
+
+
+    def upsert(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        if not texts:
+            return
+        if self.is_known(name):
+            resp = self._send("PUT", f"/faiss/collection/{name}", vectors, {"text": texts})
+            if resp.status_code != 404:
+                resp.raise_for_status()
+                return
+            # collection was removed on service side (restart, cleanup)
+            self._forget(name)
+
+        resp = self._send("POST", f"/faiss/collection/{name}", vectors, {"text": texts})
+        if resp.status_code in (400, 409):
+            # created by another process after our set was loaded
+            self._remember(name)
+            self.append(name, vectors, texts)
+            return
+        resp.raise_for_status()
+        self._remember(name)
+
+
+    def search(self, name: str, query: np.ndarray, k: int, text: str | None = None) -> list[dict]:
+        # service decides top k by itself, result is cut on our side
+        resp = self._send("POST", f"/faiss/collections/{name}/similar", query)
+        if resp.status_code == 404:
+            self._forget(name)
+        resp.raise_for_status()
+        return resp.json()[-1][:k]
+
+
+    def delete(self, name: str) -> None:
+        resp = self.session.delete(f"{self.url}/faiss/collection/{name}")
+        self._forget(name)
+        if resp.status_code != 404:
+            resp.raise_for_status()
+
+
+
+class LocalCollection:
+    def __init__(self, dim: int, capacity: int = 1024):
+        # rows are L2 normalized, dot product == cosine similarity
+        self.matrix = np.empty((capacity, dim), dtype=np.float32)
+        self.size = 0
+        self.metadata: list[dict] = []
+
+
+    def add(self, vectors: np.ndarray, texts: list[str]) -> None:
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        if vectors.shape[1] != self.matrix.shape[1]:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} does not match collection dimension {self.matrix.shape[1]}")
+
+        needed = self.size + len(vectors)
+        if needed > len(self.matrix):
+            # grow by doubling, appends are amortized O(1) per vector
+            grown = np.empty((max(needed, len(self.matrix) * 2), self.matrix.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.matrix[:self.size]
+            self.matrix = grown
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.matrix[self.size:needed] = vectors / np.maximum(norms, 1e-12)
+        # size is updated last, concurrent search see only complete rows
+        self.metadata += [{"text": text} for text in texts]
+        self.size = needed
+
+
+    def search(self, query: np.ndarray, k: int) -> list[dict]:
+        size = self.size
+        if size == 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.matrix[:size] @ query
+
+        k = min(k, size)
+        # argpartition finds top k in O(n), only k results are sorted
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [{**self.metadata[idx], "score": float(scores[idx])} for idx in top]
+
+
+
+class LocalVectorStore(VectorStore):
+    """ In-process vector storage, no network hop and no json encoding of vectors. """
+
+    def __init__(self):
+        self._collections: dict[str, LocalCollection] = {}
+        self._lock = threading.RLock()
+
+
+    def collections(self) -> list[str]:
+        with self._lock:
+            return list(self._collections)
+
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            return name in self._collections
+
+
+    def create(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        # dimension of collection is not known from empty batch
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            collection = LocalCollection(vectors.shape[-1], capacity=max(1024, len(texts)))
+            collection.add(vectors, texts)
+            self._collections[name] = collection
+
+
+    def append(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        with self._lock:
+            if name not in self._collections:
+                raise KeyError(f"Collection {name} does not exist")
+            self._collections[name].add(vectors, texts)
+
+
+    def upsert(self, name: str, vectors: np.ndarray, texts: list[str]) -> None:
+        with self._lock:
+            if name in self._collections:
+                self._collections[name].add(vectors, texts)
+            else:
+                self.create(name, vectors, texts)
+
+
+    def search(self, name: str, query: np.ndarray, k: int, text: str | None = None) -> list[dict]:
+        with self._lock:
+            if name not in self._collections:
+                raise KeyError(f"Collection {name} does not exist")
+            collection = self._collections[name]
+        # search runs without lock, several queries can be scored in parallel
+        return collection.search(query, k)
+
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            self._collections.pop(name, None)
+
+
+    def trim(self, name: str, keep: int) -> None:
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None or collection.size <= keep:
+                return
+
+            # new object instead of changing rows in place, running searches keep old one
+            size = collection.size
+            trimmed = LocalCollection(collection.matrix.shape[1], capacity=max(1024, keep))
+            if keep > 0:
+                trimmed.add(
+                    collection.matrix[size - keep:size],
+                    [meta["text"] for meta in collection.metadata[size - keep:size]],
+                )
+            self._collections[name] = trimmed
+
+
+
+def make_vector_store(kind: str, url: str, transport: str = "auto") -> VectorStore:
+    if kind == "http":
+        return HTTPVectorStore(url, transport)
+    if kind == "local":
+        return LocalVectorStore()
+    raise ValueError(f"Unknown vector store '{kind}', expected 'http' or 'local'")
@@ -111,6 +111,21 @@ def clean_html(html: str, drop_tags: List[str]) -> str:
     return str(soup)
 
 
+def extract_text_from_link(link: str, drop_tags: List[str] | None) -> Article | None:
+    """ Fetch one page and extract its article text, None when page is empty or not parsed. """
+    html = trafilatura.fetch_url(link)
+    if not html:
+        return None
+
+    cleaned_html = clean_html(html, drop_tags)
+
+    text = trafilatura.extract(cleaned_html)
+    if not text:
+        return None
+
+    return {"link": link, "text": text}
+
+
 def extract_texts_from_links(
     links: List[str], drop_tags: List[str], with_log: bool
 ) -> List[Article]:
@@ -129,19 +144,13 @@ def extract_texts_from_links(
         if with_log:
             print(f"[{i}/{len(links)}] Fetching: {link}")
 
-        html = trafilatura.fetch_url(link)
-        if not html:
-            continue
-
-        cleaned_html = clean_html(html, drop_tags)
-
-        text = trafilatura.extract(cleaned_html)
-        if not text:
+        article = extract_text_from_link(link, drop_tags)
+        if article is None:
             if with_log:
                 print(f"{RED}FAILED{RESET}")
             continue
 
-        result.append({"link": link, "text": text})
+        result.append(article)
         if with_log:
             print(f"{GREEN}SUCCESS{RESET}")
 
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# modules of repo import each other as top level packages (`controllers`, `views`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,149 @@
+"""
+Minimal stand-in for FAISS vector service, used in tests of HTTPVectorStore.
+
+Supported endpoints: GET /faiss/collections, POST/PUT/DELETE /faiss/collection/{name},
+POST /faiss/collections/{name}/similar. Bodies are json, or binary vectors format
+(see controllers.vector_store.encode_vectors) when server started with `binary=True`,
+otherwise binary body is rejected with `reject_status`. Create of existing collection
+answers `exists_status`.
+
+Run `python -m tests.fake_faiss` from repo root to compare speed of both formats.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from controllers.vector_store import VECTORS_CONTENT_TYPE, LocalVectorStore, decode_vectors
+
+
+TOP_K = 10
+
+
+
+class FakeFaissHandler(BaseHTTPRequestHandler):
+    # set by start_fake_faiss
+    store: LocalVectorStore
+    binary: bool = True
+    reject_status: int = 415
+    exists_status: int = 409
+
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+    def send_json(self, data, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def read_vectors(self) -> tuple[np.ndarray, dict | None] | None:
+        """ Parse request body, None means error response was already sent. """
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.headers.get("Content-Type", "").startswith(VECTORS_CONTENT_TYPE):
+            if not self.binary:
+                self.send_json({"detail": "unsupported media type"}, self.reject_status)
+                return None
+            return decode_vectors(body)
+
+        data = json.loads(body or b"null")
+        if isinstance(data, dict):
+            return np.asarray(data["vectors"], dtype=np.float32), data.get("metadata")
+        return np.asarray(data, dtype=np.float32).reshape(1, -1), None
+
+
+    def do_GET(self) -> None:
+        if self.path == "/faiss/collections":
+            self.send_json(self.store.collections())
+        else:
+            self.send_json({"detail": "not found"}, 404)
+
+
+    def do_DELETE(self) -> None:
+        name = self.path.removeprefix("/faiss/collection/")
+        if name not in self.store.collections():
+            self.send_json({"detail": f"collection {name} not found"}, 404)
+            return
+        self.store.delete(name)
+        self.send_json({"status": "ok"})
+
+
+    def do_POST(self) -> None:
+        if self.path.startswith("/faiss/collections/") and self.path.endswith("/similar"):
+            name = self.path.removeprefix("/faiss/collections/").removesuffix("/similar")
+            parsed = self.read_vectors()
+            if parsed is None:
+                return
+            if name not in self.store.collections():
+                self.send_json({"detail": f"collection {name} not found"}, 404)
+                return
+            vectors, _ = parsed
+            self.send_json([self.store.search(name, query, TOP_K) for query in vectors])
+        else:
+            self.write_collection(create=True)
+
+
+    def do_PUT(self) -> None:
+        self.write_collection(create=False)
+
+
+    def write_collection(self, create: bool) -> None:
+        if not self.path.startswith("/faiss/collection/"):
+            self.send_json({"detail": "not found"}, 404)
+            return
+
+        name = self.path.removeprefix("/faiss/collection/")
+        parsed = self.read_vectors()
+        if parsed is None:
+            return
+
+        vectors, metadata = parsed
+        exists = name in self.store.collections()
+        if create and exists:
+            self.send_json({"detail": f"collection {name} already exists"}, self.exists_status)
+        elif not create and not exists:
+            self.send_json({"detail": f"collection {name} not found"}, 404)
+        else:
+            self.store.upsert(name, vectors, metadata["text"])
+            self.send_json({"status": "ok", "size": len(vectors)})
+
+
+
+def start_fake_faiss(port: int = 0, binary: bool = True, reject_status: int = 415,
+                     exists_status: int = 409) -> ThreadingHTTPServer:
+    """ Start fake FAISS service in background thread, port 0 picks a free port (see `server.server_port`). """
+    handler = type("Handler", (FakeFaissHandler,), {
+        "store": LocalVectorStore(), "binary": binary,
+        "reject_status": reject_status, "exists_status": exists_status,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+
+if __name__ == "__main__":
+    from controllers.vector_store import HTTPVectorStore
+
+    for binary in (True, False):
+        server = start_fake_faiss(binary=binary)
+        store = HTTPVectorStore(f"http://127.0.0.1:{server.server_port}")
+
+        vectors = np.random.rand(20000, 384).astype(np.float32)
+        texts = [f"chunk {idx}" for idx in range(len(vectors))]
+
+        started = time.perf_counter()
+        store.upsert("demo", vectors, texts)
+        elapsed = time.perf_counter() - started
+
+        print(f"binary server: {binary}, transport: {store.transport}, upsert: {elapsed:.2f}s")
+        print(store.search("demo", vectors[42], 3))
+        server.shutdown()
@@ -0,0 +1,123 @@
+"""
+Minimal stand-in for ollama http api, used in tests and for manual runs without a GPU box
+(`python -m tests.fake_ollama` from repo root listens on port 11434).
+
+Supported endpoints: /api/chat (with stream), /api/generate, /api/embed, /api/tags.
+Answers are deterministic: chat echo last message, structured output is filled
+with defaults of schema types, embeddings are derived from text hash.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+EMBEDDING_DIM = 16
+
+
+def fake_embedding(text: str) -> list[float]:
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [byte / 255 for byte in digest[:EMBEDDING_DIM]]
+
+
+
+def fake_structured(format) -> str:
+    """ Minimal json matching schema of structured output: true, 0, "" for fields. """
+    defaults = {"boolean": True, "integer": 0, "number": 0, "string": "", "array": [], "object": {}}
+    if not isinstance(format, dict) or "properties" not in format:
+        return "{}"
+    return json.dumps({
+        name: defaults.get(field.get("type"), None)
+        for name, field in format["properties"].items()
+    })
+
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    # set by start_fake_ollama
+    models: list[str] = []
+    delay: float = 0.0
+
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+    def send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self) -> None:
+        if self.path == "/api/tags":
+            self.send_json({"models": [{"model": model, "name": model} for model in self.models]})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = request.get("model", "")
+
+        if self.models and model not in self.models and f"{model}:latest" not in self.models:
+            self.send_json({"error": f"model '{model}' not found"}, 404)
+            return
+
+        time.sleep(self.delay)
+        stats = {
+            "done": True,
+            "total_duration": 2_000_000, "load_duration": 100_000,
+            "prompt_eval_count": 5, "prompt_eval_duration": 500_000,
+            "eval_count": 3, "eval_duration": 1_000_000,
+        }
+
+        if self.path == "/api/embed":
+            inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            self.send_json({"model": model, "embeddings": [fake_embedding(text) for text in inputs]})
+
+        elif self.path == "/api/generate":
+            content = fake_structured(request["format"]) if request.get("format") else f"echo: {request.get('prompt', '')}"
+            self.send_json({"model": model, "created_at": "", "response": content, **stats})
+
+        elif self.path == "/api/chat":
+            last = request["messages"][-1]["content"] if request.get("messages") else ""
+            content = fake_structured(request["format"]) if request.get("format") else f"echo: {last}"
+
+            if not request.get("stream", True):
+                self.send_json({"model": model, "created_at": "", "message": {"role": "assistant", "content": content}, **stats})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for token in content.split(" "):
+                chunk = {"model": model, "created_at": "", "message": {"role": "assistant", "content": token + " "}, "done": False}
+                self.wfile.write((json.dumps(chunk) + "\n").encode())
+                self.wfile.flush()
+            last_chunk = {"model": model, "created_at": "", "message": {"role": "assistant", "content": ""}, **stats}
+            self.wfile.write((json.dumps(last_chunk) + "\n").encode())
+
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+
+
+def start_fake_ollama(models: list[str] | None = None, port: int = 0, delay: float = 0.0) -> ThreadingHTTPServer:
+    """ Start fake ollama in background thread, port 0 picks a free port (see `server.server_port`). """
+    handler = type("Handler", (FakeOllamaHandler,), {"models": models or [], "delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+
+if __name__ == "__main__":
+    server = start_fake_ollama(port=11434)
+    print(f"Fake ollama on http://127.0.0.1:{server.server_port}")
+    while True:
+        time.sleep(3600)
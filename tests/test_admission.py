@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from fake_ollama import fake_embedding, start_fake_ollama
+from controllers import ollama as controller
+from controllers.admission import AdmissionController, Overloaded
+from controllers.ollama_pool import OllamaPool
+from views import ollama as provider
+
+
+@pytest.fixture
+def server():
+    server = start_fake_ollama(models=["all-minilm:latest"], delay=0.01)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+
+def test_limit_of_model():
+    admission = AdmissionController({"llama3": 2}, default_limit=4)
+    assert admission.limit("llama3:latest") == 2
+    assert admission.limit("gemma3:27b") == 4
+
+
+def test_full_queue_rejects():
+    admission = AdmissionController({"llama3": 1}, max_queue=1, queue_timeout=5)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with admission.acquire("llama3"):
+            entered.set()
+            release.wait(5)
+
+    def wait():
+        with admission.acquire("llama3"):
+            pass
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait(5)
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while admission._gate("llama3").waiting == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(Overloaded) as error:
+        with admission.acquire("llama3"):
+            pass
+    assert error.value.reason == "queue_full"
+
+    release.set()
+    holder.join()
+    waiter.join()
+
+
+def test_large_embedding_request_is_not_rejected(server, monkeypatch):
+    pool = OllamaPool([f"http://127.0.0.1:{server.server_port}"])
+    pool.refresh_models()
+    monkeypatch.setattr(controller, "pool", pool)
+    # 40 batches of 64 texts, far more than slots plus queue
+    monkeypatch.setattr(controller, "admission", AdmissionController(default_limit=4, max_queue=8))
+
+    texts = [f"text {idx}" for idx in range(40 * 64)]
+    result = asyncio.run(provider.async_embed_batched(texts, "all-minilm:latest", max_batch_size=64))
+
+    assert result.shape[0] == len(texts)
+    assert np.allclose(result[100], fake_embedding(texts[100]))
@@ -0,0 +1,45 @@
+import numpy as np
+
+from controllers.hybrid_store import HybridVectorStore
+from controllers.vector_store import LocalVectorStore
+
+
+TEXTS = ["red apple pie", "green pear tart", "blue berry jam"]
+
+
+def vectors(rows: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).random((rows, 8), dtype=np.float32)
+
+
+
+def test_collection_created_by_process_is_fused():
+    store = HybridVectorStore(LocalVectorStore(), candidates=3)
+    store.upsert("docs", vectors(3), TEXTS)
+    store.upsert("docs", vectors(1, seed=1), ["yellow lemon curd"])
+
+    hits = store.search("docs", vectors(1, seed=2)[0], 4, text="lemon")
+    assert hits[0]["text"] == "yellow lemon curd"
+    assert len(store._indexes["docs"].texts) == 4
+
+
+def test_collection_from_before_start_stays_dense():
+    dense = LocalVectorStore()
+    dense.upsert("docs", vectors(3), TEXTS)
+
+    # process restarted, collection is already in store
+    store = HybridVectorStore(dense, candidates=3)
+    store.upsert("docs", vectors(1, seed=1), ["yellow lemon curd"])
+
+    query = vectors(1, seed=2)[0]
+    assert "docs" not in store._indexes
+    assert store.search("docs", query, 2, text="lemon") == dense.search("docs", query, 2)
+
+
+def test_deleted_collection_gets_new_index():
+    dense = LocalVectorStore()
+    dense.upsert("docs", vectors(3), TEXTS)
+    store = HybridVectorStore(dense, candidates=3)
+
+    store.delete("docs")
+    store.upsert("docs", vectors(1, seed=1), ["yellow lemon curd"])
+    assert store._indexes["docs"].texts == ["yellow lemon curd"]
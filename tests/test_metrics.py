@@ -0,0 +1,19 @@
+from controllers import metrics
+from controllers.metrics import MetricsRegistry, model_label
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests", ("model",)).labels('x"y\\z\nw').inc()
+    assert 'requests_total{model="x\\"y\\\\z\\nw"} 1.0' in registry.render().splitlines()
+
+
+def test_model_labels_are_capped(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MAX_MODELS", 2)
+    monkeypatch.setattr(metrics, "_model_labels", set())
+
+    assert model_label("llama3") == "llama3:latest"
+    assert model_label("gemma3:27b") == "gemma3:27b"
+    assert model_label("unknown") == "other"
+    # models seen before cap keep their series
+    assert model_label("llama3:latest") == "llama3:latest"
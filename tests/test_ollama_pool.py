@@ -0,0 +1,107 @@
+import httpx
+import pytest
+from ollama import ResponseError
+
+from fake_ollama import start_fake_ollama
+from controllers.ollama_pool import OllamaPool
+
+
+def url(server) -> str:
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def chat(pool: OllamaPool, model: str, conversation_id: str | None = None) -> str:
+    with pool.acquire(model, conversation_id) as host:
+        host.client.chat(model, [{"role": "user", "content": "hi"}])
+        return host.host
+
+
+@pytest.fixture
+def servers():
+    started = [
+        start_fake_ollama(models=["llama3:latest", "all-minilm:latest"]),
+        start_fake_ollama(models=["llama3:latest"]),
+        start_fake_ollama(models=["gemma3:27b"]),
+    ]
+    yield started
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def pool(servers):
+    pool = OllamaPool([url(server) for server in servers], max_failures=2, eject_seconds=60)
+    pool.refresh_models()
+    return pool
+
+
+
+def test_refresh_models(pool, servers):
+    models = {host["host"]: host["models"] for host in pool.stats}
+    assert models[url(servers[0])] == ["all-minilm:latest", "llama3:latest"]
+    assert models[url(servers[1])] == ["llama3:latest"]
+    assert models[url(servers[2])] == ["gemma3:27b"]
+
+
+def test_routes_by_model(pool, servers):
+    # "llama3" is the same model as "llama3:latest"
+    assert chat(pool, "llama3") in (url(servers[0]), url(servers[1]))
+    assert chat(pool, "gemma3:27b") == url(servers[2])
+    assert chat(pool, "all-minilm") == url(servers[0])
+
+
+def test_least_outstanding(pool, servers):
+    with pool.acquire("llama3") as first:
+        with pool.acquire("llama3") as second:
+            assert {first.host, second.host} == {url(servers[0]), url(servers[1])}
+    assert all(host["outstanding"] == 0 for host in pool.stats)
+
+
+def test_conversation_stays_on_host(pool):
+    hosts = {chat(pool, "llama3", conversation_id="conv-1") for _ in range(5)}
+    assert len(hosts) == 1
+
+
+def test_failover_ejects_dead_host(pool, servers):
+    dead = url(servers[0])
+    servers[0].shutdown()
+    servers[0].server_close()
+
+    # conversation sticks to dead host until it is ejected
+    pool._affinity["conv-1"] = next(host for host in pool.hosts if host.host == dead)
+    for _ in range(pool.max_failures):
+        with pytest.raises((httpx.TransportError, ConnectionError)):
+            chat(pool, "llama3", conversation_id="conv-1")
+
+    stats = {host["host"]: host for host in pool.stats}
+    assert not stats[dead]["available"]
+    # next turns go to the other host with the model
+    assert chat(pool, "llama3", conversation_id="conv-1") == url(servers[1])
+    assert chat(pool, "llama3") == url(servers[1])
+
+
+def test_ejected_host_comes_back(servers):
+    pool = OllamaPool([url(server) for server in servers[:2]], max_failures=1, eject_seconds=0)
+    pool.refresh_models()
+    host = pool.hosts[0]
+    pool._failed(host)
+
+    # eject time is over, host gets requests again and success resets failures
+    assert pool.stats[0]["available"]
+    assert chat(pool, "all-minilm") == host.host
+    assert host.failures == 0
+
+
+def test_missing_model_is_forgotten(pool, servers):
+    host = next(host for host in pool.hosts if host.host == url(servers[1]))
+    # host reported model which was removed later
+    host.models.add("all-minilm:latest")
+    pool._affinity["conv-2"] = host
+
+    with pytest.raises(ResponseError):
+        with pool.acquire("all-minilm", "conv-2") as picked:
+            picked.client.embed("all-minilm", "hello")
+
+    assert "all-minilm:latest" not in host.models
+    assert chat(pool, "all-minilm", conversation_id="conv-2") == url(servers[0])
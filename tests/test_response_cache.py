@@ -0,0 +1,31 @@
+import asyncio
+import sqlite3
+
+from controllers.response_cache import ResponseCache
+
+
+def rows(path) -> int:
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+
+def test_disk_table_is_capped(tmp_path):
+    path = tmp_path / "responses.sqlite"
+    cache = ResponseCache(max_entries=10, path=path, max_disk_entries=50)
+    for idx in range(200):
+        cache.set(f"key {idx}", f"value {idx}")
+
+    assert rows(path) <= 50
+    # newest rows are kept, they are read from file after restart
+    assert ResponseCache(path=path, max_disk_entries=50).get("key 199") == "value 199"
+
+
+def test_async_access_uses_file(tmp_path):
+    path = tmp_path / "responses.sqlite"
+
+    async def roundtrip() -> str | None:
+        await ResponseCache(path=path).async_set("key", "value")
+        return await ResponseCache(path=path).async_get("key")
+
+    assert asyncio.run(roundtrip()) == "value"
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+from views import routing
+from views.llm_planer import Validation
+
+
+class FakeEmbeddingRouter:
+    def __init__(self):
+        self.learned: list[tuple[str, int]] = []
+
+
+    def classify(self, prompt: str):
+        return None
+
+
+    def is_confident(self, guess) -> bool:
+        return False
+
+
+    def add_exemplar(self, prompt: str, route: int) -> None:
+        self.learned.append((prompt, route))
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = FakeEmbeddingRouter()
+    monkeypatch.setattr(routing, "ROUTER", "embedding")
+    monkeypatch.setattr(routing, "ROUTER_LEARN", True)
+    monkeypatch.setattr(routing, "embedding_router", router)
+    monkeypatch.setattr(routing, "llm_router", lambda prompt: SimpleNamespace(output=SimpleNamespace(route=1)))
+    return router
+
+
+def validators(monkeypatch, meaningful: bool, ready: bool) -> None:
+    monkeypatch.setattr(routing, "validate_meaningful_input", lambda *args: Validation(state=meaningful, text=""))
+    monkeypatch.setattr(routing, "validate_routing_readiness", lambda *args: Validation(state=ready, text=""))
+
+
+
+@pytest.mark.parametrize("meaningful, ready", [(False, True), (True, False)])
+def test_speculative_does_not_learn_rejected_input(router, monkeypatch, meaningful, ready):
+    validators(monkeypatch, meaningful, ready)
+    result = routing.speculative_validate_and_route("find cheap flights")
+    assert result["route"] is None
+    assert router.learned == []
+
+
+def test_speculative_learns_valid_input(router, monkeypatch):
+    validators(monkeypatch, True, True)
+    result = routing.speculative_validate_and_route("find cheap flights")
+    assert result["route"] == 1
+    assert router.learned == [("find cheap flights", 1)]
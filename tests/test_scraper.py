@@ -0,0 +1,26 @@
+import time
+
+from views import scraper
+
+
+def test_duplicate_link_belongs_to_first_query(monkeypatch):
+    results = {
+        "slow": ["https://a.com/page", "https://b.com"],
+        "fast": ["https://a.com/page/#top", "https://c.com"],
+    }
+
+    def get_search_links(query: str, count: int) -> list[str]:
+        # first query finishes its search last
+        time.sleep(0.2 if query == "slow" else 0)
+        return results[query]
+
+    monkeypatch.setattr(scraper, "get_search_links", get_search_links)
+    monkeypatch.setattr(scraper, "extract_text_from_link", lambda link, drop_tags: {"link": link, "text": link})
+
+    found = sorted((query_idx, link_idx, article["link"])
+                   for query_idx, link_idx, article in scraper.search_and_extract_many(["slow", "fast"]))
+    assert found == [
+        (0, 0, "https://a.com/page"),
+        (0, 1, "https://b.com"),
+        (1, 1, "https://c.com"),
+    ]
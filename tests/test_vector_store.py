@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from fake_faiss import start_fake_faiss
+from controllers.vector_store import HTTPVectorStore, LocalVectorStore, decode_vectors, encode_vectors
+
+
+def url(server) -> str:
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def vectors(rows: int, dim: int = 8, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).random((rows, dim), dtype=np.float32)
+
+
+@pytest.fixture
+def start():
+    started = []
+
+    def start(**kwargs):
+        server = start_fake_faiss(**kwargs)
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+
+def test_codec_roundtrip():
+    data = vectors(5)
+    decoded, metadata = decode_vectors(encode_vectors(data, {"text": ["a", "b", "c", "d", "e"]}))
+    assert np.array_equal(decoded, data)
+    assert metadata == {"text": ["a", "b", "c", "d", "e"]}
+
+
+def test_codec_single_vector_without_metadata():
+    data = vectors(1)[0]
+    decoded, metadata = decode_vectors(encode_vectors(data))
+    assert decoded.shape == (1, 8)
+    assert np.array_equal(decoded[0], data)
+    assert metadata is None
+
+
+def test_codec_rejects_bad_body():
+    body = encode_vectors(vectors(2))
+    with pytest.raises(ValueError):
+        decode_vectors(b"XXXX" + body[4:])
+    with pytest.raises(ValueError):
+        decode_vectors(body[:-4])
+
+
+def test_auto_switches_to_binary(start):
+    store = HTTPVectorStore(url(start()))
+    store.upsert("docs", vectors(3), ["a", "b", "c"])
+    assert store.transport == "binary"
+    assert [hit["text"] for hit in store.search("docs", vectors(3)[1], 1)] == ["b"]
+
+
+@pytest.mark.parametrize("status", [415, 422, 400])
+def test_json_fallback_when_binary_rejected(start, status):
+    store = HTTPVectorStore(url(start(binary=False, reject_status=status)))
+    store.upsert("docs", vectors(3), ["a", "b", "c"])
+    assert store.transport == "json"
+    assert [hit["text"] for hit in store.search("docs", vectors(3)[2], 1)] == ["c"]
+
+
+def test_binary_transport_does_not_fall_back(start):
+    store = HTTPVectorStore(url(start(binary=False)), transport="binary")
+    with pytest.raises(Exception):
+        store.upsert("docs", vectors(3), ["a", "b", "c"])
+    assert store.transport == "binary"
+
+
+@pytest.mark.parametrize("exists_status", [409, 400])
+def test_create_of_existing_collection_appends(start, exists_status):
+    server = start(exists_status=exists_status)
+    other = HTTPVectorStore(url(server))
+    store = HTTPVectorStore(url(server))
+    # names are listed before other process creates collection
+    assert not store.exists("docs")
+
+    other.upsert("docs", vectors(2), ["a", "b"])
+    store.upsert("docs", vectors(2, seed=1), ["c", "d"])
+
+    # plain 400 without content type in body is not taken for rejected binary
+    assert store.transport == "binary"
+    assert server.RequestHandlerClass.store._collections["docs"].size == 4
+
+
+def test_upsert_recreates_collection_removed_on_service(start):
+    server = start()
+    store = HTTPVectorStore(url(server))
+    store.upsert("docs", vectors(2), ["a", "b"])
+    server.RequestHandlerClass.store.delete("docs")
+
+    store.upsert("docs", vectors(1, seed=1), ["c"])
+    assert store.exists("docs")
+    assert server.RequestHandlerClass.store._collections["docs"].size == 1
+
+
+def test_empty_upsert_is_noop(start):
+    server = start()
+    empty = np.empty((0, 0), dtype=np.float32)
+
+    local = LocalVectorStore()
+    local.upsert("docs", empty, [])
+    assert not local.exists("docs")
+    local.upsert("docs", vectors(2), ["a", "b"])
+    local.upsert("docs", empty, [])
+    assert local._collections["docs"].size == 2
+
+    store = HTTPVectorStore(url(server))
+    store.upsert("docs", empty, [])
+    assert not store.exists("docs")
@@ -1,6 +1,10 @@
+import sys
+import time
+
 from .llm_planer import validate_with_metadata
 from .llm_router import llm_router
 from .planer import llm_planner
+from .routing import ROUTING_MODES, validate_and_route
 
 # TEST_CASES = [
 #     # 1. Базовий shallow (0)
@@ -96,6 +100,42 @@ TEST_CASES = [
 ]
 
 
+def compare_modes(modes: tuple[str, ...] = ROUTING_MODES, cases: list[tuple] = TEST_CASES) -> dict:
+    """
+    Run every test case in every routing mode, expected route -1 means
+    one of validators must reject message.
+    Prints accuracy, mean latency and agreement of each mode with the first one.
+    Validator answers are cached, run with RESPONSE_CACHE_TTL=0 to compare latency.
+    """
+    report = {mode: {"correct": 0, "seconds": 0.0, "routes": []} for mode in modes}
+
+    for i, (prompt, img_flag, doc_flag, correct) in enumerate(cases, start=1):
+        line = [f"{i:>3}. expected {correct:>2}"]
+        for mode in modes:
+            started = time.perf_counter()
+            result = validate_and_route(prompt, has_image=img_flag, has_doc=doc_flag, mode=mode)
+            report[mode]["seconds"] += time.perf_counter() - started
+
+            route = -1 if result["route"] is None else result["route"]
+            report[mode]["routes"].append(route)
+            report[mode]["correct"] += route == correct
+            line.append(f"{mode}: {route:>2} {'PASS' if route == correct else 'ERROR'}")
+        print("  ".join(line), "|", prompt)
+
+    print()
+    baseline = report[modes[0]]["routes"]
+    for mode in modes:
+        stats = report[mode]
+        agree = sum(a == b for a, b in zip(stats["routes"], baseline))
+        print(
+            f"{mode:<12} accuracy {stats['correct']}/{len(cases)}"
+            f"  mean latency {stats['seconds'] / max(len(cases), 1):.2f}s"
+            f"  agrees with {modes[0]} {agree}/{len(cases)}"
+        )
+
+    return report
+
+
 def main() -> None:
     print("=== Metadata-aware validators (Ollama + Pydantic) ===")
     print("Input: prompt + flags has_image / has_doc.")
@@ -174,4 +214,8 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    # python -m views.agentic compare [mode ...]
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        compare_modes(tuple(sys.argv[2:]) or ROUTING_MODES)
+    else:
+        main()
@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from pydantic import BaseModel
+
+from . import ollama as ollama_views
+
+
+ROUTER_EMBEDDING_MODEL: str = os.environ.get('ROUTER_EMBEDDING_MODEL', 'all-minilm')
+# route is trusted when nearest exemplar is close enough and other routes are clearly further
+ROUTER_MIN_SIMILARITY: float = float(os.environ.get('ROUTER_MIN_SIMILARITY', 0.55))
+ROUTER_MIN_MARGIN: float = float(os.environ.get('ROUTER_MIN_MARGIN', 0.05))
+ROUTER_NEIGHBOURS: int = int(os.environ.get('ROUTER_NEIGHBOURS', 1))
+# jsonl {"text": ..., "route": ...}, routes chosen by llm router are appended here
+ROUTER_EXEMPLARS_PATH: str = os.environ.get('ROUTER_EXEMPLARS_PATH', '.cache/router_exemplars.jsonl')
+# exemplars learned from traffic over this limit replace the oldest ones
+ROUTER_MAX_EXEMPLARS: int = int(os.environ.get('ROUTER_MAX_EXEMPLARS', 5000))
+
+
+# examples from router prompt, TEST_CASES have no image intent without attachment
+PROMPT_EXEMPLARS: list[tuple[str, int]] = [
+    ("What is Docker?", 0),
+    ("Explain Docker in simple terms.", 0),
+    ("How do I write a for loop in Go?", 0),
+    ("Deep research Docker using web sources.", 1),
+    ("Latest Docker trends?", 1),
+    ("Find recent news about Docker in 2025.", 1),
+    ("Check current Bitcoin price today.", 1),
+    ("What is Docker based on my docs?", 2),
+    ("Explain the architecture from my documentation.", 2),
+    ("Summarize my PDF about Docker.", 2),
+    ("Describe what is in my screenshot.", 3),
+    ("Based on my image, is this Docker logo correct?", 3),
+    ("In the photo I sent before, what is on the left?", 3),
+]
+
+
+
+class RouteGuess(BaseModel):
+    route: int
+    # similarity of best route minus similarity of second best route
+    confidence: float
+    similarity: float
+
+
+
+class EmbeddingRouter:
+    """
+    k-NN classifier over embedded exemplars of every route.
+
+    Score of route is mean similarity of its `neighbours` closest exemplars
+    (1 by default, some routes have only few exemplars), guess is confident
+    when best score is above `min_similarity` and ahead of second route by `min_margin`.
+
+    Seed exemplars are always kept, exemplars learned from traffic fill the rest of
+    `max_exemplars` rows and replace the oldest learned ones when matrix is full.
+    Log file is rewritten with kept exemplars when it grows to twice of them.
+    """
+
+    def __init__(self, model: str = ROUTER_EMBEDDING_MODEL, min_similarity: float = ROUTER_MIN_SIMILARITY,
+                 min_margin: float = ROUTER_MIN_MARGIN, neighbours: int = ROUTER_NEIGHBOURS,
+                 path: Path | None = None, max_exemplars: int = ROUTER_MAX_EXEMPLARS):
+        self.model = model
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.neighbours = neighbours
+        self.path = path
+        self.max_exemplars = max_exemplars
+
+        # row i of matrix is exemplar texts[i] of route routes[i], rows [0, size) are filled
+        self.texts: list[str] = []
+        self.routes = np.empty(0, dtype=np.int64)
+        self.vectors: np.ndarray | None = None
+        self.size = 0
+        self._rows: dict[str, int] = {}
+        # seed rows are never replaced, learned rows are replaced in order of age
+        self._pinned = 0
+        self._replaced = 0
+        self._logged = 0
+        self._seeded = False
+        self._lock = threading.Lock()
+
+
+    def seed(self) -> None:
+        """ Embed exemplars from TEST_CASES, router prompt and traffic log, done once on first use. """
+        # agentic imports routing modes, import here to avoid import cycle
+        from .agentic import TEST_CASES
+
+        exemplars = list(PROMPT_EXEMPLARS)
+        # attachments decide route by themselves, only text intent is useful
+        exemplars += [(prompt, route) for prompt, img, doc, route in TEST_CASES if not img and not doc and route >= 0]
+        self._add(exemplars, pin=True)
+
+        if self.path is not None and self.path.exists():
+            learned: dict[str, int] = {}
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        learned[record["text"]] = int(record["route"])
+                        self._logged += 1
+            # only newest learned exemplars fit, older ones are not embedded at all
+            self._add(list(learned.items())[max(len(learned) - self.learned_capacity, 0):] if self.learned_capacity else [])
+
+        self._seeded = True
+
+
+    @property
+    def learned_capacity(self) -> int:
+        return max(self.max_exemplars - self._pinned, 0)
+
+
+    def _reserve(self, rows: int, dim: int) -> None:
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if rows <= capacity:
+            return
+        # matrix grows by doubling, rows are not copied on every add
+        capacity = max(rows, min(max(capacity * 2, 64), max(self.max_exemplars, rows)))
+        vectors = np.empty((capacity, dim), dtype=np.float32)
+        routes = np.empty(capacity, dtype=np.int64)
+        if self.vectors is not None:
+            vectors[:self.size] = self.vectors[:self.size]
+            routes[:self.size] = self.routes[:self.size]
+        self.vectors, self.routes = vectors, routes
+
+
+    def _add(self, exemplars: list[tuple[str, int]], pin: bool = False) -> None:
+        exemplars = list(dict((text, route) for text, route in exemplars if text not in self._rows).items())
+        if not exemplars:
+            return
+
+        vectors = ollama_views.get_embendings([text for text, _ in exemplars], model=self.model)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        for (text, route), vector in zip(exemplars, vectors):
+            if pin or self.size < self.max_exemplars:
+                row = self.size
+                self._reserve(row + 1, len(vector))
+                self.texts.append(text)
+                self.size += 1
+                self._pinned += pin
+            elif self.learned_capacity > 0:
+                row = self._pinned + self._replaced % self.learned_capacity
+                self._replaced += 1
+                del self._rows[self.texts[row]]
+                self.texts[row] = text
+            else:
+                continue
+            self.vectors[row] = vector
+            self.routes[row] = route
+            self._rows[text] = row
+
+
+    def add_exemplar(self, text: str, route: int, persist: bool = True) -> None:
+        """ Extend exemplars with routed traffic, e.g. decisions of llm router. """
+        with self._lock:
+            if not self._seeded:
+                self.seed()
+            if text in self._rows:
+                return
+            self._add([(text, route)])
+
+            if persist and self.path is not None:
+                self._log(text, route)
+
+
+    def _log(self, text: str, route: int) -> None:
+        # called under lock
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self._logged >= 2 * max(self.learned_capacity, 1):
+            # log is compacted to exemplars which are still kept
+            learned = [(self.texts[row], int(self.routes[row])) for row in range(self._pinned, self.size)]
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as file:
+                for learned_text, learned_route in learned:
+                    file.write(json.dumps({"text": learned_text, "route": learned_route}, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+            self._logged = len(learned)
+            return
+
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps({"text": text, "route": route}, ensure_ascii=False) + "\n")
+        self._logged += 1
+
+
+    def classify(self, query: str) -> RouteGuess | None:
+        with self._lock:
+            if not self._seeded:
+                self.seed()
+            if self.size == 0:
+                return None
+
+        query_emb = ollama_views.get_embendings([query], model=self.model)[-1]
+        query_emb = query_emb / max(float(np.linalg.norm(query_emb)), 1e-12)
+
+        # rows can be replaced by add_exemplar, matrix is read under lock
+        with self._lock:
+            similarities = self.vectors[:self.size] @ query_emb
+            routes = self.routes[:self.size].copy()
+
+        scores: dict[int, float] = {}
+        for route in np.unique(routes):
+            route_similarities = np.sort(similarities[routes == route])[::-1]
+            scores[int(route)] = float(route_similarities[:self.neighbours].mean())
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_route, best_score = ranked[0]
+        second_score = ranked[1][1] if len(ranked) > 1 else -1.0
+
+        return RouteGuess(route=best_route, confidence=best_score - second_score, similarity=best_score)
+
+
+    def is_confident(self, guess: RouteGuess | None) -> bool:
+        return guess is not None and guess.similarity >= self.min_similarity and guess.confidence >= self.min_margin
+
+
+
+embedding_router = EmbeddingRouter(path=Path(ROUTER_EXEMPLARS_PATH) if ROUTER_EXEMPLARS_PATH else None)
+
+
+
+if __name__ == "__main__":
+    while True:
+        query = input("input>>> ")
+        guess = embedding_router.classify(query)
+        print(guess, "confident" if embedding_router.is_confident(guess) else "fallback to llm router")
@@ -0,0 +1,57 @@
+import os
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+from controllers.vector_store import VectorStore
+from . import ollama as ollama_views
+from .stream import merge_streams
+
+
+# chunks in one embed + upsert step
+INGEST_BATCH_SIZE: int = int(os.environ.get('INGEST_BATCH_SIZE', 128))
+# batches waiting between stages, bounds memory of ingest regardless of document size
+INGEST_MAX_PENDING: int = int(os.environ.get('INGEST_MAX_PENDING', 2))
+# pdf pages extracted and chunked at once
+INGEST_PAGE_WINDOW: int = int(os.environ.get('INGEST_PAGE_WINDOW', 8))
+
+
+
+def batched(items: Iterable[str], size: int) -> Iterator[list[str]]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+
+def ingest(chunks: Iterable[str], store: VectorStore, collection_name: str, model: str = "all-minilm",
+           batch_size: int | None = None, max_pending: int | None = None,
+           on_stored: Callable[[list[str]], None] | None = None) -> int:
+    """
+    Streaming ingest: chunks -> embedding batches -> incremental upserts.
+
+    Extraction of chunks, embedding and upload run in separate threads connected
+    by bounded queues, so they overlap and slow stage holds back the others.
+    `on_stored` is called with every batch after it is upserted.
+    Returns number of stored chunks.
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    max_pending = max_pending or INGEST_MAX_PENDING
+
+    # extraction stage (pdf parsing and chunking) runs in its own thread
+    batches = merge_streams(batched(chunks, batch_size), max_buffer=max_pending)
+
+    # embedding stage
+    embedded = merge_streams(
+        ((batch, ollama_views.get_embendings(batch, model=model)) for batch in batches),
+        max_buffer=max_pending,
+    )
+
+    # upload stage, first batch creates collection, next ones are appended
+    stored = 0
+    for batch, vectors in embedded:
+        store.upsert(collection_name, vectors, batch)
+        stored += len(batch)
+        if on_stored is not None:
+            on_stored(batch)
+
+    return stored
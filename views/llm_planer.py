@@ -1,8 +1,8 @@
 import json
 from typing import Dict, Any
 
-import ollama
 from pydantic import BaseModel
+from controllers import ollama as controller
 
 
 # ===== 1. Shared Pydantic response model =====
@@ -282,15 +282,15 @@ def validate_meaningful_input(
     """
     llm_input = build_llm_input(prompt, has_image, has_doc)
 
-    response = ollama.generate(
-        model=model_name,
+    raw_json = controller.generate(
         prompt=llm_input,
+        model=model_name,
         system=SYSTEM_PROMPT_MEANINGFUL,
         format=SCHEMA,
-        stream=False,
+        options={"temperature": 0},
+        cache=True,
+        site="validator_meaningful",
     )
-
-    raw_json = response["response"]
     return Validation.model_validate_json(raw_json)
 
 
@@ -311,15 +311,15 @@ def validate_routing_readiness(
     """
     llm_input = build_llm_input(prompt, has_image, has_doc)
 
-    response = ollama.generate(
-        model=model_name,
+    raw_json = controller.generate(
         prompt=llm_input,
+        model=model_name,
         system=SYSTEM_PROMPT_ROUTING,
         format=SCHEMA,
-        stream=False,
+        options={"temperature": 0},
+        cache=True,
+        site="validator_routing",
     )
-
-    raw_json = response["response"]
     return Validation.model_validate_json(raw_json)
 
 
@@ -422,7 +422,137 @@ def validate_with_metadata(
     }
 
 
-# ===== 8. Simple CLI for manual testing (optional) =====
+# ===== 8. Fused mode: both validators + router in one LLM call =====
+
+
+class FusedDecision(BaseModel):
+    meaningful: bool
+    routing_ok: bool
+    route: int  # 0, 1, 2 or 3, ignored when one of checks failed
+    text: str
+
+
+def build_system_fused(schema_dict: Dict[str, Any]) -> str:
+    """
+    Agents #1, #2 and #3 in one prompt, GLOBAL_ROUTING_SPEC is processed once.
+    Returns JSON: { "meaningful": bool, "routing_ok": bool, "route": int, "text": str }.
+    """
+    return (
+        "You are the INPUT VALIDATOR and ROUTER of a message processing pipeline.\n"
+        "For a SINGLE user message (plus metadata) you make three decisions in order:\n"
+        "  1. meaningful - is the message a clear, meaningful question or request?\n"
+        "  2. routing_ok - is the intent specific enough to choose exactly one route?\n"
+        "  3. route      - which processing path (0..3) must handle the message.\n"
+        "You do NOT answer the question itself.\n\n"
+        "GLOBAL ROUTING SPECIFICATION:\n"
+        f"{GLOBAL_ROUTING_SPEC}\n\n"
+        "INPUT FORMAT YOU RECEIVE (as plain text):\n"
+        "[METADATA]\n"
+        "image_attached: true/false\n"
+        "document_attached: true/false\n"
+        "\n"
+        "[USER_INPUT]\n"
+        "<the actual text written by the user>\n\n"
+        "The metadata describes ONLY this message. There is NO chat history.\n\n"
+        "DECISION 1 - meaningful:\n"
+        "- true when the text is a question or request in natural language (even with\n"
+        "  grammar mistakes or in another language) that could fit one of the routes.\n"
+        "- false when the text is mostly random characters or noise, or there is no\n"
+        '  obvious question/request at all ("asdqwe!!!@@@", "??", "do it").\n'
+        "- NEVER set false only because you do not understand a term, or because docs/images\n"
+        "  are mentioned but document_attached=false / image_attached=false.\n\n"
+        "DECISION 2 - routing_ok (only when meaningful = true):\n"
+        "- true when the message clearly says WHAT the user wants and WHAT it refers to.\n"
+        '  Examples: "What is Docker?", "Latest Docker trends?", "What is Docker based on my docs?",\n'
+        '  document_attached=true + "Summarize this document".\n'
+        "- false when it is too vague to pick a topic or object:\n"
+        '  "Help me", "Fix this", "Explain this" with no attachments.\n'
+        "- Do NOT reject because referenced docs/images might not exist.\n\n"
+        "DECISION 3 - route (only when meaningful = true and routing_ok = true):\n"
+        "- document_attached = true -> route = 2.\n"
+        "- image_attached = true    -> route = 3.\n"
+        "- otherwise choose by intent of the text using the global specification:\n"
+        "    2 - answer based on user documents/files/PDFs,\n"
+        "    3 - answer based on user images/photos/screenshots,\n"
+        "    1 - explicit web search or fresh, time-sensitive information,\n"
+        "    0 - any other clear question (definitions, explanations, coding, history).\n"
+        "- Tie-breaking: 2 (docs) > 3 (images) > 1 (web) > 0 (shallow).\n\n"
+        "OUTPUT FORMAT (STRICT):\n"
+        "- You MUST return ONLY JSON that matches the following JSON Schema.\n"
+        "- Do NOT add any text outside the JSON. No markdown, no code fences.\n"
+        "- Semantics:\n"
+        '    * all checks passed -> text MUST be "" (empty string).\n'
+        "    * meaningful = false -> routing_ok = false, route = 0, text is a short English\n"
+        "      message: the message is unclear, ask what they need, 2–4 follow-up questions.\n"
+        "    * routing_ok = false -> route = 0, text is a short English message: not enough\n"
+        "      information for routing, 2–4 specific follow-up questions (each on a new line).\n\n"
+        "Here is the JSON Schema your response MUST conform to:\n"
+        f"{json.dumps(schema_dict, ensure_ascii=False, indent=2)}"
+    )
+
+
+FUSED_SCHEMA: Dict[str, Any] = FusedDecision.model_json_schema()
+SYSTEM_PROMPT_FUSED: str = build_system_fused(FUSED_SCHEMA)
+
+
+def validate_and_route_fused(
+    prompt: str,
+    has_image: bool = False,
+    has_doc: bool = False,
+    model_name: str = "llama3",
+) -> dict:
+    """
+    Same contract as `validate_with_metadata`, plus "route" key,
+    but validators and router are answered by one structured-output call.
+
+    Route from attachments has priority over route chosen by model,
+    route is None when one of checks failed.
+    """
+    normalized_prompt, auto_prompt = normalize_prompt(prompt, has_image, has_doc)
+
+    # auto prompt and empty input are decided without LLM
+    if auto_prompt or not normalized_prompt:
+        result = validate_with_metadata(prompt, has_image=has_image, has_doc=has_doc, model_name=model_name)
+        route = (3 if has_image else 2) if result["meaningful"].state else None
+        return {**result, "route": route}
+
+    llm_input = build_llm_input(normalized_prompt, has_image, has_doc)
+    raw_json = controller.generate(
+        prompt=llm_input,
+        model=model_name,
+        system=SYSTEM_PROMPT_FUSED,
+        format=FUSED_SCHEMA,
+        options={"temperature": 0},
+        cache=True,
+        site="validator_fused",
+    )
+    decision = FusedDecision.model_validate_json(raw_json)
+
+    result = {
+        "normalized_prompt": normalized_prompt,
+        "auto_prompt": False,
+        "meaningful": Validation(state=decision.meaningful, text="" if decision.meaningful else decision.text),
+        "routing": None,
+        "route": None,
+    }
+    if not decision.meaningful:
+        return result
+
+    result["routing"] = Validation(state=decision.routing_ok, text="" if decision.routing_ok else decision.text)
+    if not decision.routing_ok:
+        return result
+
+    if has_image:
+        result["route"] = 3
+    elif has_doc:
+        result["route"] = 2
+    else:
+        # model can answer out of range, treat it as plain question
+        result["route"] = decision.route if decision.route in (0, 1, 2, 3) else 0
+    return result
+
+
+# ===== 9. Simple CLI for manual testing (optional) =====
 
 
 def main() -> None:
@@ -101,6 +101,9 @@ def llm_router(query: str, model: str = "llama3:latest") -> JSONFormat:
         query=format,
         model=model,
         options=OllamaOptions(temperature=0),
+        # router prompt is fixed, same query always gives same route
+        cache=True,
+        site="router",
     )
 
 
@@ -4,6 +4,11 @@ from models.Answer import (
 )
 from models.ollama import OllamaOptions
 from controllers import ollama as controller
+from controllers.embedding_cache import EmbeddingCache
+from controllers.embedding_batcher import EmbeddingBatcher
+from controllers.image_preprocess import ImagePreprocessor
+from controllers.metrics import registry as metrics_registry
+from controllers.context_packer import ContextPacker, TokenCounter, load_pretrained
 from pathlib import Path
 from pydantic import BaseModel
 from rich.console import Console
@@ -12,6 +17,8 @@ from PIL import Image
 import requests
 from io import BytesIO
 import numpy as np
+import asyncio
+import os
 from rich.panel import Panel
 
 
@@ -24,18 +31,21 @@ from rich.panel import Panel
 
 
 def rag_answer(query: RagAnswer, model: str, separate_context: bool = True, history: list[Answer] | None = None,
-               options: OllamaOptions | None = None) -> RagAnswer:
+               options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default") -> RagAnswer:
     if query.answer is not None:
         raise ValueError("Message are already answered")
 
 
     messages = list() if history is None else [i for ans in history for i in ans.answer_dict]
+    query = pack_context(query, model, messages, options)
     messages += query.answer_dict(separate_context)
 
     response: dict[str, str] = controller.answer(
         messages = messages, 
         model = model, 
-        options = options.get_dict if options is not None else options
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
     )
 
     query.set_answer(response)
@@ -45,18 +55,21 @@ def rag_answer(query: RagAnswer, model: str, separate_context: bool = True, hist
 
 
 def stream_rag_answer(query: RagAnswer, model: str, separate_context: bool = True, history: list[Answer] | None = None,
-               options: OllamaOptions | None = None):
+               options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default"):
     if query.answer is not None:
         raise ValueError("Message are already answered")
 
 
     messages = list() if history is None else [i for ans in history for i in ans.answer_dict]
+    query = pack_context(query, model, messages, options)
     messages += query.answer_dict(separate_context)
 
     for token in controller.stream_answer(
         messages = messages, 
         model = model, 
-        options = options.get_dict if options is not None else options
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
     ):
         yield token
 
@@ -65,17 +78,21 @@ def stream_rag_answer(query: RagAnswer, model: str, separate_context: bool = Tru
 
 
 # answer for text/image question
-def answer(query: Answer, model: str, history: list[Answer] | None = None, options: OllamaOptions | None = None) -> Answer:
+def answer(query: Answer, model: str, history: list[Answer] | None = None,
+           options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default") -> Answer:
     if query.answer is not None:
         raise ValueError("Message are already answered")
 
     messages = list() if history is None else [i for ans in history for i in  ans.answer_dict]
     messages += query.answer_dict
+    messages = image_preprocessor.prepare_messages(messages, model)
 
     response: dict[str, str] = controller.answer(
         messages = messages, 
         model = model,
-        options = options.get_dict if options is not None else options
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
     )
     query.set_answer(response)
 
@@ -83,17 +100,21 @@ def answer(query: Answer, model: str, history: list[Answer] | None = None, optio
     return query
 
 
-def stream_answer(query: Answer, model: str, history: list[Answer] | None = None, options: OllamaOptions | None = None):
+def stream_answer(query: Answer, model: str, history: list[Answer] | None = None,
+                  options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default"):
     if query.answer is not None:
         raise ValueError("Message are already answered")
 
     messages = list() if history is None else [i for ans in history for i in  ans.answer_dict]
     messages += query.answer_dict
+    messages = image_preprocessor.prepare_messages(messages, model)
 
     for token in controller.stream_answer(
         messages = messages, 
         model = model,
-        options = options.get_dict if options is not None else options
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
     ):
         yield token
 
@@ -101,7 +122,8 @@ def stream_answer(query: Answer, model: str, history: list[Answer] | None = None
 
 
 
-def json_output(query: JSONFormat, model: str, options: OllamaOptions | None = None) -> JSONFormat:
+def json_output(query: JSONFormat, model: str, options: OllamaOptions | None = None, conversation_id: str | None = None,
+        cache: bool = False, site: str = "default") -> JSONFormat:
     if query.output is not None:
         raise ValueError("Message are already answered")
     if isinstance(query.answer, RagAnswer):
@@ -114,20 +136,159 @@ def json_output(query: JSONFormat, model: str, options: OllamaOptions | None = N
         messages=messages, 
         model=model, 
         format=query.format,
-        options = options.get_dict if options is not None else options
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site,
+        cache = cache
     )
     return query
         
 
 
 
-def get_embendings(texts: list[str], model: str) -> np.ndarray:
-    result = [controller.get_embedding(text, model) for text in texts]
-    return np.array(result)
+# images are downscaled for vision model before they are sent to ollama
+image_preprocessor = ImagePreprocessor(
+    default_max_edge = int(os.environ.get('IMAGE_MAX_EDGE', 1024)),
+    quality = int(os.environ.get('IMAGE_JPEG_QUALITY', 85)),
+    max_cache_bytes = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+)
+
+
+
+# limits for one `embed` request, texts are split to batches by both of them
+EMBEDDING_MAX_BATCH_SIZE: int = int(os.environ.get('EMBEDDING_MAX_BATCH_SIZE', 64))
+EMBEDDING_MAX_BATCH_CHARS: int = int(os.environ.get('EMBEDDING_MAX_BATCH_CHARS', 32_000))
+
+# embeddings cache, empty EMBEDDING_CACHE_DIR keep cache only in memory
+EMBEDDING_CACHE_DIR: str = os.environ.get('EMBEDDING_CACHE_DIR', '.cache/embeddings')
+
+embedding_cache = EmbeddingCache(
+    path = Path(EMBEDDING_CACHE_DIR) if EMBEDDING_CACHE_DIR else None,
+    memory_size = int(os.environ.get('EMBEDDING_CACHE_MEMORY_SIZE', 10_000)),
+    max_disk_rows = int(os.environ.get('EMBEDDING_CACHE_MAX_DISK_ROWS', 200_000)),
+)
+
+metrics_registry.counter(
+    "embedding_cache_requests_total", "Embedding cache lookups by result", ("result",),
+    callback=lambda: {
+        ("memory_hit",): embedding_cache.memory_hits,
+        ("disk_hit",): embedding_cache.disk_hits,
+        ("miss",): embedding_cache.misses,
+    },
+)
+
+
+
+# tokenizer of rag context, empty CONTEXT_TOKENIZER reuse tokenizer of pdf chunker
+CONTEXT_TOKENIZER: str = os.environ.get('CONTEXT_TOKENIZER', '')
+
+
+def load_context_tokenizer():
+    if CONTEXT_TOKENIZER:
+        return load_pretrained(CONTEXT_TOKENIZER)
+    from controllers.pdf_reader import tokenizer
+    return tokenizer.backend_tokenizer
+
+
+# rag context is packed to token budget of model, OLLAMA_NUM_CTX is num_ctx of ollama server,
+# tokenizer is loaded in lifespan of api
+context_packer = ContextPacker(
+    counter = TokenCounter(load_context_tokenizer),
+    num_ctx = int(os.environ.get('OLLAMA_NUM_CTX', 4096)),
+    answer_reserve = int(os.environ.get('CONTEXT_ANSWER_RESERVE', 1024)),
+    min_trim_tokens = int(os.environ.get('CONTEXT_MIN_TRIM_TOKENS', 64)),
+)
+
+
+def pack_context(query: RagAnswer, model: str, history_messages: list[dict[str, str]],
+                 options: OllamaOptions | None = None) -> RagAnswer:
+    """ Drop or trim lowest ranked chunks of query context which do not fit to model window. """
+    # answer_dict extends other_dict in place, prompt is collected without it
+    prompt = history_messages + list(query.other_dict or []) + [{'role': query.query_role, 'content': query.query}]
+
+    budget = context_packer.budget(model, prompt, options.num_ctx if options is not None else None)
+    packed = context_packer.pack(query.context, budget)
+    if packed.dropped or packed.trimmed:
+        print(f"Context of {model} packed: {packed}")
+
+    query.context = packed.context
+    return query
+
+
+def embedding_batches(texts: list[str], max_batch_size: int, max_batch_chars: int) -> list[tuple[int, int]]:
+    """
+    Split texts to consecutive (start, end) ranges, each range is one embed request.
+    Text longer than `max_batch_chars` is sent alone in its own batch.
+    """
+    batches: list[tuple[int, int]] = []
+    start, chars = 0, 0
+
+    for idx, text in enumerate(texts):
+        if idx > start and (idx - start >= max_batch_size or chars + len(text) > max_batch_chars):
+            batches.append((start, idx))
+            start, chars = idx, 0
+        chars += len(text)
+
+    if start < len(texts):
+        batches.append((start, len(texts)))
+
+    return batches
+
+
+
+def embed_batched(texts: list[str], model: str, max_batch_size: int | None = None,
+                  max_batch_chars: int | None = None) -> np.ndarray:
+    batches = embedding_batches(
+        texts,
+        max_batch_size or EMBEDDING_MAX_BATCH_SIZE,
+        max_batch_chars or EMBEDDING_MAX_BATCH_CHARS,
+    )
+
+    result: np.ndarray | None = None
+    for start, end in batches:
+        vectors = controller.get_embeddings(texts[start:end], model)
+        # dimension is known only after first response, matrix is allocated once
+        if result is None:
+            result = np.empty((len(texts), len(vectors[0])), dtype=np.float32)
+        result[start:end] = vectors
+
+    return result if result is not None else np.empty((0, 0), dtype=np.float32)
+
+
+
+def merge_cached(texts: list[str], cached: list[np.ndarray | None], computed_texts: list[str],
+                 computed: np.ndarray | None) -> np.ndarray:
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+
+    dim = computed.shape[1] if computed is not None else len(cached[0])
+    rows = {text: row for row, text in enumerate(computed_texts)}
+
+    result = np.empty((len(texts), dim), dtype=np.float32)
+    for idx, vector in enumerate(cached):
+        result[idx] = vector if vector is not None else computed[rows[texts[idx]]]
+
+    return result
+
 
 
+def get_embendings(texts: list[str], model: str, max_batch_size: int | None = None,
+                   max_batch_chars: int | None = None, use_cache: bool = True) -> np.ndarray:
+    cached = embedding_cache.get_many(model, texts) if use_cache else [None] * len(texts)
 
-def answer_with_tools(query: ToolCall, model: str, options: OllamaOptions | None = None) -> ToolCall:
+    # every distinct uncached text is embedded only once
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+    computed = embed_batched(missing, model, max_batch_size, max_batch_chars) if missing else None
+
+    if computed is not None and use_cache:
+        embedding_cache.put_many(model, missing, computed)
+
+    return merge_cached(texts, cached, missing, computed)
+
+
+
+def answer_with_tools(query: ToolCall, model: str,
+                      options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default") -> ToolCall:
     if query.tools_execution is not None:
         raise ValueError("Message are already answered")
 
@@ -140,7 +301,9 @@ def answer_with_tools(query: ToolCall, model: str, options: OllamaOptions | None
         messages = messages,
         tools = query.get_tool_dict,
         model = model,
-        options = options.get_dict if options is not None else options
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
     )
 
 
@@ -154,6 +317,200 @@ def answer_with_tools(query: ToolCall, model: str, options: OllamaOptions | None
 
 
 
+# --- async versions of wrappers above, they use async controller functions ---
+
+async def async_rag_answer(query: RagAnswer, model: str, separate_context: bool = True, history: list[Answer] | None = None,
+               options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default") -> RagAnswer:
+    if query.answer is not None:
+        raise ValueError("Message are already answered")
+
+
+    messages = list() if history is None else [i for ans in history for i in ans.answer_dict]
+    # tokenizing of chunks is cpu bound, not on event loop
+    query = await asyncio.to_thread(pack_context, query, model, messages, options)
+    messages += query.answer_dict(separate_context)
+
+    response: dict[str, str] = await controller.async_answer(
+        messages = messages, 
+        model = model, 
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
+    )
+
+    query.set_answer(response)
+
+    return query
+
+
+
+async def async_stream_rag_answer(query: RagAnswer, model: str, separate_context: bool = True, history: list[Answer] | None = None,
+               options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default"):
+    if query.answer is not None:
+        raise ValueError("Message are already answered")
+
+
+    messages = list() if history is None else [i for ans in history for i in ans.answer_dict]
+    # tokenizing of chunks is cpu bound, not on event loop
+    query = await asyncio.to_thread(pack_context, query, model, messages, options)
+    messages += query.answer_dict(separate_context)
+
+    async for token in controller.async_stream_answer(
+        messages = messages, 
+        model = model, 
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
+    ):
+        yield token
+
+
+
+async def async_answer(query: Answer, model: str, history: list[Answer] | None = None,
+                       options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default") -> Answer:
+    if query.answer is not None:
+        raise ValueError("Message are already answered")
+
+    messages = list() if history is None else [i for ans in history for i in  ans.answer_dict]
+    messages += query.answer_dict
+    # resize is cpu work, keep it out of event loop
+    messages = await asyncio.to_thread(image_preprocessor.prepare_messages, messages, model)
+
+    response: dict[str, str] = await controller.async_answer(
+        messages = messages, 
+        model = model,
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
+    )
+    query.set_answer(response)
+
+    return query
+
+
+
+async def async_stream_answer(query: Answer, model: str, history: list[Answer] | None = None,
+                              options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default"):
+    if query.answer is not None:
+        raise ValueError("Message are already answered")
+
+    messages = list() if history is None else [i for ans in history for i in  ans.answer_dict]
+    messages += query.answer_dict
+    # resize is cpu work, keep it out of event loop
+    messages = await asyncio.to_thread(image_preprocessor.prepare_messages, messages, model)
+
+    async for token in controller.async_stream_answer(
+        messages = messages, 
+        model = model,
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
+    ):
+        yield token
+
+
+
+async def async_json_output(query: JSONFormat, model: str, options: OllamaOptions | None = None, conversation_id: str | None = None,
+        cache: bool = False, site: str = "default") -> JSONFormat:
+    if query.output is not None:
+        raise ValueError("Message are already answered")
+    if isinstance(query.answer, RagAnswer):
+        messages = query.answer.answer_dict(separate_context=False)
+    else:
+        messages = query.answer.answer_dict 
+
+    query.output = await controller.async_json_answer(
+        messages=messages, 
+        model=model, 
+        format=query.format,
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site,
+        cache = cache
+    )
+    return query
+
+
+
+async def async_embed_batched(texts: list[str], model: str, max_batch_size: int | None = None,
+                              max_batch_chars: int | None = None) -> np.ndarray:
+    batches = embedding_batches(
+        texts,
+        max_batch_size or EMBEDDING_MAX_BATCH_SIZE,
+        max_batch_chars or EMBEDDING_MAX_BATCH_CHARS,
+    )
+    # batches in flight are bounded by slots of model, otherwise one large request
+    # fills admission queue by itself and fails with Overloaded
+    in_flight = asyncio.Semaphore(max(controller.admission.limit(model), 1))
+
+    async def embed(start: int, end: int) -> list[list[float]]:
+        async with in_flight:
+            return await controller.async_get_embeddings(texts[start:end], model)
+
+    # gather keep order of batches
+    responses = await asyncio.gather(*[embed(start, end) for start, end in batches])
+
+    if not responses:
+        return np.empty((0, 0), dtype=np.float32)
+
+    result = np.empty((len(texts), len(responses[0][0])), dtype=np.float32)
+    for (start, end), vectors in zip(batches, responses):
+        result[start:end] = vectors
+
+    return result
+
+
+
+async def async_get_embendings(texts: list[str], model: str, max_batch_size: int | None = None,
+                               max_batch_chars: int | None = None, use_cache: bool = True) -> np.ndarray:
+    # disk cache reads memmap and appends files under lock shared with ingest threads, not on event loop
+    cached = await asyncio.to_thread(embedding_cache.get_many, model, texts) if use_cache else [None] * len(texts)
+
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+    computed = await async_embed_batched(missing, model, max_batch_size, max_batch_chars) if missing else None
+
+    if computed is not None and use_cache:
+        await asyncio.to_thread(embedding_cache.put_many, model, missing, computed)
+
+    return merge_cached(texts, cached, missing, computed)
+
+
+
+# merge concurrent embedding requests (from different http requests) to one embed call
+embedding_batcher = EmbeddingBatcher(
+    embed = async_get_embendings,
+    max_wait_ms = float(os.environ.get('EMBEDDING_BATCH_MAX_WAIT_MS', 5)),
+    max_batch = int(os.environ.get('EMBEDDING_BATCH_MAX_INPUTS', 256)),
+)
+
+
+
+async def async_answer_with_tools(query: ToolCall, model: str,
+                                  options: OllamaOptions | None = None, conversation_id: str | None = None, site: str = "default") -> ToolCall:
+    if query.tools_execution is not None:
+        raise ValueError("Message are already answered")
+
+    if isinstance(query.answer, RagAnswer):
+        messages = query.answer.answer_dict(separate_context=False)
+    else:
+        messages = query.answer.answer_dict 
+
+    result = await controller.async_tool_calling(
+        messages = messages,
+        tools = query.get_tool_dict,
+        model = model,
+        options = options.get_dict if options is not None else options,
+        conversation_id = conversation_id,
+        site = site
+    )
+
+    query.answer.set_answer(result[-1])
+    query.tools_execution = result[:-1]
+
+    return query
+
+
+
 # use for long conversation
 def next_gen(conv: Conversation, history_top_k: int = 1) -> Conversation:
     conv.last_answer = answer(
@@ -1,57 +1,116 @@
 from . import ollama as ollama_views
 from models.Answer import *
 from controllers import pdf_reader
-import requests
-from .scraper import search_and_extract
+from controllers.vector_store import VectorStore, make_vector_store
+from controllers.ingest_registry import IngestRegistry, content_digest
+from controllers.session_store import SessionStore, SessionVectorStore
+from controllers.hybrid_store import HybridVectorStore
+from controllers.response_cache import ResponseCache
+from .scraper import search_and_extract_many
 from .clean import semantic_clean
-from .llm_planer import validate_with_metadata
-from .llm_router import llm_router
+from .routing import validate_and_route
 from .planer import llm_planner
+from .stream import coalesce, merge_streams
+from .ingest import INGEST_PAGE_WINDOW, ingest
+from pydantic import Field
 import json
 import io
+import os
 import base64
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 
 #FAISS_URL = "http://host.docker.internal:8004"
-FAISS_URL = 'http://localhost:8004'
+FAISS_URL: str = os.environ.get('FAISS_URL', 'http://localhost:8004')
+# "http" - external FAISS service on FAISS_URL, "local" - in-process index
+VECTOR_STORE: str = os.environ.get('VECTOR_STORE', 'http')
+VECTOR_TOP_K: int = int(os.environ.get('VECTOR_TOP_K', 5))
+# vectors wire format for FAISS service: "auto" (binary with json fallback), "binary", "json"
+VECTOR_TRANSPORT: str = os.environ.get('VECTOR_TRANSPORT', 'auto')
+
+# "hybrid" - dense search fused with in-process BM25 over the same chunks, "dense" - vectors only
+RETRIEVAL_MODE: str = os.environ.get('RETRIEVAL_MODE', 'hybrid')
+
+base_store: VectorStore = make_vector_store(VECTOR_STORE, FAISS_URL, VECTOR_TRANSPORT)
+if RETRIEVAL_MODE == 'hybrid':
+    base_store = HybridVectorStore(
+        base_store,
+        candidates = int(os.environ.get('HYBRID_CANDIDATES', 30)),
+        rrf_k = int(os.environ.get('HYBRID_RRF_K', 60)),
+    )
+
+# conversations idle for SESSION_IDLE_TTL seconds lose their collections,
+# collection over SESSION_MAX_VECTORS is compacted before next write
+sessions = SessionStore(
+    base_store,
+    idle_ttl = float(os.environ.get('SESSION_IDLE_TTL', 24 * 3600)),
+    max_vectors = int(os.environ.get('SESSION_MAX_VECTORS', 50_000)),
+    cleanup_interval = float(os.environ.get('SESSION_CLEANUP_INTERVAL', 300)),
+)
+vector_store: VectorStore = SessionVectorStore(sessions.store, sessions)
+
+# hashes of ingested documents and chunks, file only makes sense for FAISS service
+# which keeps collections when this process restarts
+INGEST_REGISTRY_PATH: str = os.environ.get('INGEST_REGISTRY_PATH', '')
+
+ingest_registry = IngestRegistry(Path(INGEST_REGISTRY_PATH) if INGEST_REGISTRY_PATH else None)
+# removed vectors must be ingested again when document is sent next time
+sessions.on_evict.append(ingest_registry.forget)
+
+# descriptions of images by (content hash, model, prompt), vision model is the most expensive call
+IMAGE_DESCRIPTION_CACHE_PATH: str = os.environ.get('IMAGE_DESCRIPTION_CACHE_PATH', '.cache/image_descriptions.sqlite')
+IMAGE_DESCRIPTION_CONCURRENCY: int = int(os.environ.get('IMAGE_DESCRIPTION_CONCURRENCY', 4))
+
+description_cache = ResponseCache(
+    ttl = float(os.environ.get('IMAGE_DESCRIPTION_CACHE_TTL', 30 * 24 * 3600)),
+    max_entries = int(os.environ.get('IMAGE_DESCRIPTION_CACHE_SIZE', 4096)),
+    path = Path(IMAGE_DESCRIPTION_CACHE_PATH) if IMAGE_DESCRIPTION_CACHE_PATH else None,
+    max_disk_entries = int(os.environ.get('IMAGE_DESCRIPTION_CACHE_DISK_SIZE', 100_000)),
+)
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_DESCRIPTION_CONCURRENCY, thread_name_prefix="describe")
+# key -> future of description which is generated right now
+describing: dict[str, Future] = {}
+describing_lock = threading.Lock()
+
+# run planner stream and retrieval of route concurrently
+PIPELINE_CONCURRENT_STAGES: bool = os.environ.get('PIPELINE_CONCURRENT_STAGES', '1') == '1'
 
 
 def docs_pipeline(
     query: str, collection_name: str, docs_path: list[Path] | list[bytes] | None = None
 ):
 
-    # read docs if provided
+    # read docs if provided, pages -> chunks -> embeddings -> vector db as bounded stream
     if docs_path is not None:
-        chunks: list[str] = []
+        if not vector_store.exists(collection_name):
+            # collection was deleted or store restarted, registry must not skip anything
+            ingest_registry.forget(collection_name)
 
         for doc in docs_path:
-            chunks += pdf_reader.read_pdf(doc)
+            # same document sent again (or resent every turn by frontend) is not ingested twice
+            doc_digest = content_digest(doc)
+            if ingest_registry.has_document(collection_name, doc_digest):
+                continue
 
-        # make vectors from text
-        embedding = ollama_views.get_embendings(chunks, model="all-minilm")
-
-        # update vector db if docs provided
-        if (
-            collection_name
-            not in requests.get(f"{FAISS_URL}/faiss/collections").json()
-        ):
-            requests.post(
-                f"{FAISS_URL}/faiss/collection/{collection_name}",
-                json={"vectors": embedding.tolist(), "metadata": {"text": chunks}},
+            # changed document: only chunks that are not in collection yet are embedded
+            chunks = ingest_registry.unseen_chunks(
+                collection_name, pdf_reader.iter_pdf_chunks(doc, window_pages=INGEST_PAGE_WINDOW)
             )
-        else:
-            requests.put(
-                f"{FAISS_URL}/faiss/collection/{collection_name}",
-                json={"vectors": embedding.tolist(), "metadata": {"text": chunks}},
+            generation = sessions.generation(collection_name)
+            ingest(
+                chunks, vector_store, collection_name, model="all-minilm",
+                on_stored=lambda batch: ingest_registry.add_chunks(collection_name, batch),
             )
+            # collection compacted during ingest lost first chunks of document, it is not complete
+            if sessions.generation(collection_name) == generation:
+                ingest_registry.add_document(collection_name, doc_digest)
 
     # get embendings from query
     query_emb = ollama_views.get_embendings([query], model="all-minilm")[-1]
 
     # search top k simple query
-    similar = requests.post(
-        f"{FAISS_URL}/faiss/collections/{collection_name}/similar",
-        json=query_emb.tolist(),
-    ).json()[-1]
+    similar = vector_store.search(collection_name, query_emb, VECTOR_TOP_K, text=query)
 
     # generate answer on it
     return ollama_views.stream_rag_answer(
@@ -66,9 +125,54 @@ def docs_pipeline(
             ],
         ),
         model="llama3:latest",
+        conversation_id=collection_name,
+        site="rag_answer",
     )
 
 
+def describe_image(image: bytes, model: str, prompt: str) -> str:
+    key = description_cache.key(image=content_digest(image), model=model, prompt=prompt)
+
+    cached = description_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with describing_lock:
+        future = describing.get(key)
+        owner = future is None
+        if owner:
+            # same image can be described by concurrent request right now, wait for it
+            future = describing[key] = Future()
+
+    if not owner:
+        return future.result()
+
+    try:
+        description = ollama_views.answer(
+            query=ImageAnswer(query=prompt, paths=[image]),
+            model=model,
+            site="image_description",
+        ).answer
+        description_cache.set(key, description)
+        future.set_result(description)
+        return description
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with describing_lock:
+            describing.pop(key, None)
+
+
+
+def describe_images(images: list[bytes], model: str,
+                    prompt: str = "Please provide full describe and information for this image") -> list[str]:
+    """ Descriptions of distinct images, uncached ones are described concurrently. """
+    distinct = list({content_digest(image): image for image in images}.values())
+    return list(image_executor.map(lambda image: describe_image(image, model, prompt), distinct))
+
+
+
 def image_pipeline(
     query: str, collection_name: str, images_path: list[Path] | list[bytes] | None = None
 ):
@@ -99,55 +203,34 @@ def image_pipeline(
         
         images_path = img_path
 
-        images_disc = []
-        for image in images_path:
-            images_disc.append(
-                ollama_views.answer(
-                    query=ImageAnswer(
-                        query="Please provide full describe and information for this image",
-                        paths=[image],
-                    ),
-                    model="gemma3:27b",
-                ).answer
-            )
+        # one vision call per distinct image, descriptions are cached between turns
+        images_disc = describe_images(images_path, model="gemma3:27b")
 
-        # make vectors from images descriptions
-        img_embedding = ollama_views.get_embendings(images_disc, model="all-minilm")
-
-        # update vector db if images provided
-        if (
-            collection_name
-            not in requests.get(f"{FAISS_URL}/faiss/collections").json()
-        ):
-            requests.post(
-                f"{FAISS_URL}/faiss/collection/{collection_name}",
-                json={
-                    "vectors": img_embedding.tolist(),
-                    "metadata": {"text": images_disc},
-                },
-            )
-        else:
-            requests.put(
-                f"{FAISS_URL}/faiss/collection/{collection_name}",
-                json={
-                    "vectors": img_embedding.tolist(),
-                    "metadata": {"text": images_disc},
-                },
-            )
+        if not vector_store.exists(collection_name):
+            ingest_registry.forget(collection_name)
+
+        # image sent again has the same description, it is already in collection
+        new_disc = list(ingest_registry.unseen_chunks(collection_name, images_disc))
+        if new_disc:
+            # make vectors from images descriptions
+            img_embedding = ollama_views.get_embendings(new_disc, model="all-minilm")
+
+            # update vector db if images provided
+            vector_store.upsert(collection_name, img_embedding, new_disc)
+            ingest_registry.add_chunks(collection_name, new_disc)
 
     # get embendings from query
     query_emb = ollama_views.get_embendings([query], model="all-minilm")[-1]
 
     # search for most similar text chunks
-    similar = requests.post(
-        f"{FAISS_URL}/faiss/collections/{collection_name}/similar",
-        json=query_emb.tolist(),
-    ).json()[-1]
+    similar = vector_store.search(collection_name, query_emb, VECTOR_TOP_K, text=query)
 
     # stream final answer with similar context
     return ollama_views.stream_rag_answer(
         query=RagAnswer(query=query, context=[vocab["text"] for vocab in similar]),
         model="llama3:latest",
+        conversation_id=collection_name,
+        site="rag_answer",
     )
 
 
@@ -158,19 +241,30 @@ def web_search_pipeline(
     # raw_texts = search_and_extract(query, count)
     # texts = semantic_clean([text["text"] for text in raw_texts], with_log=True)
 
-    texts = []
-    for web_query in list_of_query[:3]:
-        raw_texts = search_and_extract(web_query, count)
+    list_of_query = list_of_query[:3]
 
-        raw_text = [
+    # searches and page downloads of all queries run concurrently, pages are split as they arrive
+    raw_chunks: dict[tuple[int, int], list[str]] = {}
+    for query_idx, link_idx, text in search_and_extract_many(list_of_query, count):
+        raw_chunks[(query_idx, link_idx)] = [
             text["text"][idx : idx + 512]
-            for text in raw_texts
             for idx in range(0, len(text["text"]), 512)
-            if text["text"]
+        ]
+
+    texts = []
+    for query_idx in range(len(list_of_query)):
+        # pages of query in rank order, shared links belong to first query,
+        # so groups given to semantic_clean do not depend on timing of downloads
+        raw_text = [
+            chunk
+            for key in sorted(raw_chunks)
+            if key[0] == query_idx
+            for chunk in raw_chunks[key]
         ]
 
         # texts += semantic_clean([ text["text"] for text in raw_texts ], with_log=False)
-        texts += semantic_clean(raw_text, with_log=False)
+        if raw_text:
+            texts += semantic_clean(raw_text, with_log=False)
 
     # --- split web chunks for provide smaller chunks ---
     split_texts = []
@@ -195,30 +289,20 @@ def web_search_pipeline(
 
     # print(texts)
 
-    # make vectors from text
-    embedding = ollama_views.get_embendings(texts, model="all-minilm")
-
-    # update vector db if docs provided
-    if collection_name not in requests.get(f"{FAISS_URL}/faiss/collections").json():
-        requests.post(
-            f"{FAISS_URL}/faiss/collection/{collection_name}",
-            json={"vectors": embedding.tolist(), "metadata": {"text": texts}},
-        )
-    else:
-        requests.put(
-            f"{FAISS_URL}/faiss/collection/{collection_name}",
-            json={"vectors": embedding.tolist(), "metadata": {"text": texts}},
-        )
+    # update vector db if docs provided, pages can give no chunk at all
+    if texts:
+        # make vectors from text
+        embedding = ollama_views.get_embendings(texts, model="all-minilm")
+        vector_store.upsert(collection_name, embedding, texts)
 
     # get embendings from query
     query_emb = ollama_views.get_embendings([query], model="all-minilm")[-1]
 
-    # search top k simple query
+    # search top k simple query, nothing was stored yet on first empty search
     print()
-    similar = requests.post(
-        f"{FAISS_URL}/faiss/collections/{collection_name}/similar",
-        json=query_emb.tolist(),
-    ).json()[-1]
+    similar = []
+    if vector_store.exists(collection_name):
+        similar = vector_store.search(collection_name, query_emb, VECTOR_TOP_K, text=query)
 
     # generate answer on it
     return ollama_views.stream_rag_answer(
@@ -233,6 +317,8 @@ def web_search_pipeline(
             ],
         ),
         model="llama3:latest",
+        conversation_id=collection_name,
+        site="rag_answer",
     )
 
 
@@ -242,66 +328,13 @@ class QueryPipeline(BaseModel):
     query: str
     doc: bytes | None = None
     img: bytes | None = None
-    conversation_id: str = '123123'
-
-#def main_pipeline(query: str, doc: bytes | None = None, img: bytes | None = None, conversation_id: str = '123123'):
-def main_pipeline(query: QueryPipeline):
-    doc_flag, img_flag = query.doc is not None, query.img is not None
-
-    # --- first and second agent stages --- 
-    result = validate_with_metadata(query.query, has_image=img_flag, has_doc=doc_flag)
-
-    meaningful = result["meaningful"]  # Validation
-    routing_validation = result["routing"]  # Validation | None
-    
-    # --- add instead continue LLM response ---
-
-    if not meaningful.state:
-        for token in meaningful.text.split(" "):
-            yield json.dumps({ 'role': 'bot', 'token': token + " "}) + "\n"
-        
-        return json.dumps({ 'role': 'bot', 'token': " "}) + "\n"
-
-        #print(meaningful.text)
-        #raise ValueError("First agentic validation error")
-
-    if not routing_validation.state:
-        for token in routing_validation.text.split(" "):
-            yield json.dumps({ 'role': 'bot', 'token': token + " "}) + "\n"
-
-        return json.dumps({ 'role': 'bot', 'token': " "}) + "\n"
-
-            #yield token
-        #print(routing_validation.text)
-        #raise ValueError("Second agentic validation error")
-
-    # -----------------------------------------
-
-    
-    # --- end of first and second agent stages --- 
-
-
-
-    # llm router
-    route = -1
-    if img_flag:
-        route = 3
-    elif doc_flag:
-        route = 2
-    else:
-        route = int(llm_router(query.query).output.route)
+    # clients without id get own collection, generated id is returned in X-Conversation-Id header
+    conversation_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
 
 
-    # --- stream plan ---
-
-    for token in llm_planner(query.query, route):
-        #print(token, end="", flush=True)
-        yield json.dumps({ 'role': 'plan', 'token': token }) + "\n"
-
-        #yield token
-
-    # --- end of stream plan ---
 
+def route_stream(query: QueryPipeline, route: int):
+    """ NDJSON lines of selected pipeline (retrieval, ingest and final answer). """
 
     # --- get context from nikita service ---
 
@@ -312,12 +345,14 @@ def main_pipeline(query: QueryPipeline):
 
     if route == 0:
         # --- shallow model --- 
-        for token in ollama_views.stream_answer(
+        for token in coalesce(ollama_views.stream_answer(
             query = Answer(
                 query=query.query,
             ), 
-            model="llama3:latest"
-        ): 
+            model="llama3:latest",
+            conversation_id=query.conversation_id,
+            site="shallow_answer",
+        )): 
             #print(token, end="", flush=True)
             yield json.dumps({ 'role': 'bot', 'token': token }) + "\n"
             #yield token
@@ -342,7 +377,8 @@ def main_pipeline(query: QueryPipeline):
                 ), 
                 format=CreatedQuery,
             ),
-            model = 'llama3:latest'
+            model = 'llama3:latest',
+            site = 'web_queries',
         ).output.list_of_query
 
         #print("\nList of queries", list_of_query)
@@ -354,7 +390,7 @@ def main_pipeline(query: QueryPipeline):
 
         list_of_query = list_of_query[:3]
         
-        for token in web_search_pipeline(query.query, 3, collection_name=query.conversation_id, list_of_query=list_of_query):
+        for token in coalesce(web_search_pipeline(query.query, 3, collection_name=query.conversation_id, list_of_query=list_of_query)):
             #print(token, end="", flush=True)
             yield json.dumps({ 'role': 'bot', 'token': token }) + "\n"
 
@@ -362,11 +398,11 @@ def main_pipeline(query: QueryPipeline):
 
     elif route == 2:
         # --- documenet pipeline ---
-        for token in docs_pipeline(
+        for token in coalesce(docs_pipeline(
             query=query.query,
             collection_name=query.conversation_id,
             docs_path=[query.doc] if query.doc is not None else None,
-        ):
+        )):
             #print(token, end=" ", flush=True)
             yield json.dumps({ 'role': 'bot', 'token': token }) + "\n"
 
@@ -374,11 +410,11 @@ def main_pipeline(query: QueryPipeline):
 
     elif route == 3:
         # --- image pipeline ---
-        for token in image_pipeline(
+        for token in coalesce(image_pipeline(
            query=query.query,
            collection_name=query.conversation_id,
            images_path = [query.img] if query.img is not None else None
-        ):
+        )):
            #print(token, end='', flush=True)
             yield json.dumps({ 'role': 'bot', 'token': token }) + "\n"
 
@@ -389,6 +425,68 @@ def main_pipeline(query: QueryPipeline):
 
 
 
+#def main_pipeline(query: str, doc: bytes | None = None, img: bytes | None = None, conversation_id: str = '123123'):
+def main_pipeline(query: QueryPipeline):
+    doc_flag, img_flag = query.doc is not None, query.img is not None
+
+    # --- first and second agent stages and router (see ROUTING_MODE) --- 
+    result = validate_and_route(query.query, has_image=img_flag, has_doc=doc_flag)
+
+    meaningful = result["meaningful"]  # Validation
+    routing_validation = result["routing"]  # Validation | None
+    
+    # --- add instead continue LLM response ---
+
+    if not meaningful.state:
+        for token in coalesce(token + " " for token in meaningful.text.split(" ")):
+            yield json.dumps({ 'role': 'bot', 'token': token}) + "\n"
+        
+        return json.dumps({ 'role': 'bot', 'token': " "}) + "\n"
+
+        #print(meaningful.text)
+        #raise ValueError("First agentic validation error")
+
+    if not routing_validation.state:
+        for token in coalesce(token + " " for token in routing_validation.text.split(" ")):
+            yield json.dumps({ 'role': 'bot', 'token': token}) + "\n"
+
+        return json.dumps({ 'role': 'bot', 'token': " "}) + "\n"
+
+            #yield token
+        #print(routing_validation.text)
+        #raise ValueError("Second agentic validation error")
+
+    # -----------------------------------------
+
+    
+    # --- end of first and second agent stages --- 
+
+
+
+    # llm router
+    route = result["route"]
+
+
+    # --- stream plan ---
+
+    plan_lines = (
+        json.dumps({ 'role': 'plan', 'token': token }) + "\n"
+        for token in coalesce(llm_planner(query.query, route))
+    )
+
+    if route != 0 and PIPELINE_CONCURRENT_STAGES:
+        # plan is only informational, retrieval / ingest of route runs at the same time
+        # and answer starts as soon as context is ready, lines are interleaved by arrival
+        yield from merge_streams(plan_lines, route_stream(query, route))
+    else:
+        yield from plan_lines
+        yield from route_stream(query, route)
+
+    # --- end of stream plan ---
+
+
+
+
 
     
     
@@ -136,7 +136,8 @@ def llm_planner(query: str, route: int, model: str = "llama3:latest"):
                 }
             ],
         ),
-        model=model
+        model=model,
+        site="planner",
     )
 
 
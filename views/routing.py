@@ -0,0 +1,146 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .llm_planer import (
+    Validation,
+    normalize_prompt,
+    validate_meaningful_input,
+    validate_routing_readiness,
+    validate_with_metadata,
+    validate_and_route_fused,
+)
+from .llm_router import llm_router
+from .embedding_router import embedding_router
+from controllers.metrics import registry as metrics_registry
+
+
+# "sequential" - validators and router one after another,
+# "speculative" - all three llm calls are started at once,
+# "fused" - one llm call answers both validators and router
+ROUTING_MODE: str = os.environ.get('ROUTING_MODE', 'sequential')
+ROUTING_MODES: tuple[str, ...] = ("sequential", "speculative", "fused")
+ROUTING_WORKERS: int = int(os.environ.get('ROUTING_WORKERS', 32))
+# "llm" - llm_router, "embedding" - k-NN over exemplars, llm_router only when not confident
+ROUTER: str = os.environ.get('ROUTER', 'llm')
+# routes chosen by llm fallback are added to exemplars of embedding router
+ROUTER_LEARN: bool = os.environ.get('ROUTER_LEARN', '1') == '1'
+
+ROUTER_DECISIONS = metrics_registry.counter("router_decisions_total", "Routes chosen by router kind", ("router",))
+
+executor = ThreadPoolExecutor(max_workers=ROUTING_WORKERS, thread_name_prefix="routing")
+
+
+
+def fixed_route(has_image: bool, has_doc: bool) -> int | None:
+    """ Route is known from attachments, router is not called. """
+    if has_image:
+        return 3
+    if has_doc:
+        return 2
+    return None
+
+
+
+def route_query(prompt: str) -> tuple[int, bool]:
+    """ Route of message without attachments, and whether it was chosen by llm fallback. """
+    if ROUTER == "embedding":
+        guess = embedding_router.classify(prompt)
+        if embedding_router.is_confident(guess):
+            ROUTER_DECISIONS.labels("embedding").inc()
+            return guess.route, False
+
+    route = int(llm_router(prompt).output.route)
+    ROUTER_DECISIONS.labels("llm").inc()
+    return route, True
+
+
+
+def learn_route(prompt: str, route: int) -> None:
+    """ Add route chosen by llm fallback to exemplars, called only after both validators passed. """
+    if ROUTER == "embedding" and ROUTER_LEARN:
+        embedding_router.add_exemplar(prompt, route)
+
+
+
+def sequential_validate_and_route(prompt: str, has_image: bool = False, has_doc: bool = False) -> dict:
+    result = validate_with_metadata(prompt, has_image=has_image, has_doc=has_doc)
+
+    route = fixed_route(has_image, has_doc)
+    if route is None and result["meaningful"].state and result["routing"].state:
+        route, learn = route_query(prompt)
+        if learn:
+            learn_route(prompt, route)
+
+    return {**result, "route": route}
+
+
+
+def speculative_validate_and_route(prompt: str, has_image: bool = False, has_doc: bool = False) -> dict:
+    """
+    Start both validators and router at once, results are taken in the same
+    order as in sequential mode, so answer is the same (all calls have temperature 0).
+    When a validator fails, calls after it are cancelled if not started yet,
+    running ones can not be interrupted and their result is dropped.
+    """
+    normalized_prompt, auto_prompt = normalize_prompt(prompt, has_image, has_doc)
+    if auto_prompt or not normalized_prompt:
+        # no llm validation in these cases
+        return sequential_validate_and_route(prompt, has_image, has_doc)
+
+    meaningful_future = executor.submit(validate_meaningful_input, normalized_prompt, has_image, has_doc)
+    routing_future = executor.submit(validate_routing_readiness, normalized_prompt, has_image, has_doc)
+
+    route = fixed_route(has_image, has_doc)
+    router_future: Future | None = None
+    if route is None:
+        router_future = executor.submit(route_query, prompt)
+
+    result = {
+        "normalized_prompt": normalized_prompt,
+        "auto_prompt": False,
+        "meaningful": None,
+        "routing": None,
+        "route": None,
+    }
+
+    try:
+        meaningful: Validation = meaningful_future.result()
+        result["meaningful"] = meaningful
+        if not meaningful.state:
+            return result
+
+        routing: Validation = routing_future.result()
+        result["routing"] = routing
+        if not routing.state:
+            return result
+
+        if router_future is not None:
+            # router runs ahead of validators, its decision is learned only for valid input
+            route, learn = router_future.result()
+            if learn:
+                learn_route(prompt, route)
+        result["route"] = route
+        return result
+
+    finally:
+        for future in (routing_future, router_future):
+            if future is not None:
+                future.cancel()
+
+
+
+def validate_and_route(prompt: str, has_image: bool = False, has_doc: bool = False, mode: str | None = None) -> dict:
+    """
+    Run validators and router in selected mode.
+
+    Returns dict of `validate_with_metadata` with extra "route" key,
+    route is None when one of validators did not pass.
+    """
+    mode = mode or ROUTING_MODE
+    if mode == "sequential":
+        return sequential_validate_and_route(prompt, has_image, has_doc)
+    if mode == "speculative":
+        return speculative_validate_and_route(prompt, has_image, has_doc)
+    if mode == "fused":
+        return validate_and_route_fused(prompt, has_image, has_doc)
+    raise ValueError(f"Unknown routing mode '{mode}', expected 'sequential', 'speculative' or 'fused'")
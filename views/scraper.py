@@ -1,9 +1,18 @@
-from typing import List
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterator, List
+from urllib.parse import urldefrag
 from controllers.web_parsing.types import Article
-from controllers.web_parsing.scraper import extract_texts_from_links
+from controllers.web_parsing.scraper import extract_text_from_link, extract_texts_from_links
 from .parse import get_search_links
 
 
+# searches and page downloads of all requests share this pool
+WEB_FETCH_WORKERS: int = int(os.environ.get('WEB_FETCH_WORKERS', 16))
+
+web_executor = ThreadPoolExecutor(max_workers=WEB_FETCH_WORKERS, thread_name_prefix="web")
+
+
 def search_and_extract(
     query: str, count: int = 10, with_log: bool = False
 ) -> List[Article]:
@@ -23,6 +32,65 @@ def search_and_extract(
     return result
 
 
+def normalize_link(link: str) -> str:
+    """ Same page found by different queries can differ by fragment or trailing slash. """
+    return urldefrag(link).url.rstrip("/")
+
+
+def search_and_extract_many(
+    queries: List[str], count: int = 10, drop_tags: List[str] = None
+) -> Iterator[tuple[int, int, Article]]:
+    """
+    Runs searches of all queries and downloads of found pages concurrently on shared pool.
+
+    Links are de-duplicated across queries before download, link found by several
+    queries belongs to the first of them in `queries` order (not to the search that
+    finished first). Articles are yielded as soon as they are extracted.
+
+    Yields:
+        (query index, link index in its search results, Article)
+    """
+    pending: dict[Future, tuple] = {
+        web_executor.submit(get_search_links, query, count): ("search", idx)
+        for idx, query in enumerate(queries)
+    }
+    seen: set[str] = set()
+    # finished searches wait here until searches of all earlier queries are done
+    found: dict[int, list[str]] = {}
+    next_query = 0
+
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, *position = pending.pop(future)
+
+                if kind == "search":
+                    found[position[0]] = future.result()
+                    while next_query in found:
+                        for link_idx, link in enumerate(found.pop(next_query)):
+                            key = normalize_link(link)
+                            if key in seen:
+                                continue
+                            seen.add(key)
+                            fetch = web_executor.submit(extract_text_from_link, link, drop_tags)
+                            pending[fetch] = ("fetch", next_query, link_idx)
+                        next_query += 1
+                    continue
+
+                try:
+                    article = future.result()
+                except Exception:
+                    # one broken page should not fail whole research, same as sequential extract
+                    continue
+                if article is not None:
+                    yield position[0], position[1], article
+    finally:
+        # consumer stopped early, downloads which are not started are dropped
+        for future in pending:
+            future.cancel()
+
+
 def extract(
     links: List[str], drop_tags: List[str] = None, with_log: bool = False
 ) -> List[Article]:
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from typing import AsyncIterator, Iterable, Iterator
+
+
+# tokens are sent to client when window passed or buffer reached byte threshold
+STREAM_COALESCE_MS: float = float(os.environ.get('STREAM_COALESCE_MS', 30))
+STREAM_COALESCE_BYTES: int = int(os.environ.get('STREAM_COALESCE_BYTES', 512))
+
+
+
+def coalesce(tokens: Iterable[str], window_ms: float | None = None, max_bytes: int | None = None) -> Iterator[str]:
+    """
+    Join small stream tokens to bigger chunks.
+    Sync version can check window only when next token arrives.
+    """
+    window = (STREAM_COALESCE_MS if window_ms is None else window_ms) / 1000
+    max_bytes = STREAM_COALESCE_BYTES if max_bytes is None else max_bytes
+
+    buffer: list[str] = []
+    size = 0
+    started = time.perf_counter()
+
+    for token in tokens:
+        if not buffer:
+            started = time.perf_counter()
+        buffer.append(token)
+        size += len(token.encode("utf-8"))
+
+        if size >= max_bytes or time.perf_counter() - started >= window:
+            yield "".join(buffer)
+            buffer, size = [], 0
+
+    if buffer:
+        yield "".join(buffer)
+
+
+
+async def async_coalesce(tokens: AsyncIterator[str], window_ms: float | None = None,
+                         max_bytes: int | None = None) -> AsyncIterator[str]:
+    """
+    Join small stream tokens to bigger chunks, buffer is flushed by timer
+    even if the model is slow with the next token.
+    """
+    window = (STREAM_COALESCE_MS if window_ms is None else window_ms) / 1000
+    max_bytes = STREAM_COALESCE_BYTES if max_bytes is None else max_bytes
+
+    buffer: list[str] = []
+    size = 0
+    deadline = 0.0
+    iterator = tokens.__aiter__()
+    next_token: asyncio.Future | None = None
+
+    try:
+        while True:
+            if next_token is None:
+                next_token = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = max(deadline - time.perf_counter(), 0) if buffer else None
+            # asyncio.wait does not cancel pending token on timeout
+            done, _ = await asyncio.wait({next_token}, timeout=timeout)
+
+            if not done:
+                yield "".join(buffer)
+                buffer, size = [], 0
+                continue
+
+            try:
+                token = next_token.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                next_token = None
+
+            if not buffer:
+                deadline = time.perf_counter() + window
+            buffer.append(token)
+            size += len(token.encode("utf-8"))
+
+            if size >= max_bytes or window <= 0:
+                yield "".join(buffer)
+                buffer, size = [], 0
+
+        if buffer:
+            yield "".join(buffer)
+
+    finally:
+        if next_token is not None:
+            next_token.cancel()
+
+
+
+class StreamEnd:
+    """ Marker put to queue by finished producer of `merge_streams`. """
+
+    def __init__(self, error: BaseException | None = None):
+        self.error = error
+
+
+
+def merge_streams(*streams: Iterable[str], max_buffer: int = 256) -> Iterator[str]:
+    """
+    Consume every stream in its own thread and yield items in order they arrive.
+    Error of any stream is raised in consumer. When consumer stops early
+    (client disconnected) producers stop at their next item.
+    """
+    items: queue.Queue = queue.Queue(maxsize=max_buffer)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        # bounded queue gives backpressure, wait is interrupted when consumer is gone
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(stream: Iterable[str]) -> None:
+        iterator = iter(stream)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+        except BaseException as e:
+            put(StreamEnd(e))
+            return
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+        put(StreamEnd())
+
+    threads = [threading.Thread(target=produce, args=(stream,), daemon=True) for stream in streams]
+    for thread in threads:
+        thread.start()
+
+    try:
+        running = len(threads)
+        while running:
+            item = items.get()
+            if isinstance(item, StreamEnd):
+                running -= 1
+                if item.error is not None:
+                    raise item.error
+                continue
+            yield item
+    finally:
+        stopped.set()
+
+
+
+def sse_event(data: str, event: str | None = None) -> str:
+    """ Frame one `text/event-stream` event, multiline data is split to several data fields. """
+    lines = [f"event: {event}"] if event is not None else []
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
+
+
+def to_sse(chunks: Iterable[str], event: str | None = None) -> Iterator[str]:
+    for chunk in chunks:
+        yield sse_event(chunk, event)
+    yield sse_event("[DONE]", "done")
+
+
+
+async def async_to_sse(chunks: AsyncIterator[str], event: str | None = None) -> AsyncIterator[str]:
+    async for chunk in chunks:
+        yield sse_event(chunk, event)
+    yield sse_event("[DONE]", "done")